@@ -0,0 +1,151 @@
+"""
+Benchmark the record to RDF mapping pipeline on synthetic data.
+
+Times response parsing, Record.to_rdf and utils.output_graph
+serialization and reports throughput and peak memory. Runs offline.
+
+$ python benchmarks/mapping.py
+$ python benchmarks/mapping.py --authors 1,100 --records 100,100000 --formats nt
+
+Each case runs in a fresh process. Peak memory is the growth of the
+process' maximum resident set size while the stage ran.
+"""
+
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+from io import BytesIO
+from multiprocessing import Pool
+
+# The record module reads the VIVO namespace on import.
+os.environ.setdefault('DATA_NAMESPACE', 'http://vivo.school.edu/individual/')
+
+import synthetic
+
+
+def _max_rss_mb():
+    # Kilobytes on Linux, bytes on OS X.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss / 1024.0
+
+
+def _measure(stage, run):
+    base = _max_rss_mb()
+    start = time.time()
+    items = run()
+    elapsed = time.time() - start
+    return dict(stage=stage, items=items, seconds=elapsed, peak_mb=_max_rss_mb() - base)
+
+
+def parse_pages(bodies):
+    from wos2vivo.client import QueryResponse
+    records = []
+    for body in bodies:
+        records.extend(QueryResponse(body).records)
+    return records
+
+
+def stream_pages(bodies):
+    from wos2vivo.client import StreamingQueryResponse
+    num = 0
+    for body in bodies:
+        for rec in StreamingQueryResponse(BytesIO(body)).records:
+            num += 1
+    return num
+
+
+def _records(authors, records):
+    return parse_pages(synthetic.pages(records, authors))
+
+
+def _graph(authors, records):
+    from rdflib import Graph
+    g = Graph()
+    for rec in _records(authors, records):
+        for triple in rec.iter_triples():
+            g.add(triple)
+    return g
+
+
+def case(stage, authors, records, fmt=None):
+    """
+    Run one benchmark stage. Called in a child process.
+    :return: dict
+    """
+    if stage in ('parse', 'stream-parse'):
+        bodies = list(synthetic.pages(records, authors))
+        if stage == 'parse':
+            return _measure(stage, lambda: len(parse_pages(bodies)))
+        return _measure(stage, lambda: stream_pages(bodies))
+
+    if stage == 'to_rdf':
+        recs = _records(authors, records)
+
+        def run():
+            for rec in recs:
+                rec.to_rdf()
+            return len(recs)
+        return _measure(stage, run)
+
+    from wos2vivo.utils import output_graph
+    g = _graph(authors, records)
+    out = tempfile.NamedTemporaryFile(suffix='.' + fmt, delete=False)
+    out.close()
+    try:
+        result = _measure('serialize-' + fmt, lambda: output_graph(g, destination=out.name, format=fmt))
+    finally:
+        os.remove(out.name)
+    # Throughput of serialization is in triples.
+    result['items'] = len(g)
+    return result
+
+
+def run_case(args):
+    stage, authors, records, fmt = args
+    result = case(stage, authors, records, fmt)
+    result.update(authors=authors, records=records)
+    return result
+
+
+def _ints(value):
+    return [int(v) for v in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the WoS record to VIVO RDF mapping.")
+    parser.add_argument('--authors', type=_ints, default=[1, 100, 1000], help="Authors per record, comma separated.")
+    parser.add_argument('--records', type=_ints, default=[100], help="Records per batch, comma separated.")
+    parser.add_argument('--formats', default="nt,turtle,n3", help="Serialization formats, comma separated.")
+    args = parser.parse_args()
+
+    cases = []
+    for authors in args.authors:
+        for records in args.records:
+            cases.append(('parse', authors, records, None))
+            cases.append(('stream-parse', authors, records, None))
+            cases.append(('to_rdf', authors, records, None))
+            for fmt in args.formats.split(','):
+                cases.append(('serialize', authors, records, fmt))
+
+    print "{:<18} {:>8} {:>8} {:>10} {:>14} {:>10}".format(
+        "stage", "authors", "records", "seconds", "items/s", "peak MB")
+    for c in cases:
+        # One process per case so memory is measured from a clean start.
+        pool = Pool(1)
+        try:
+            result = pool.apply(run_case, (c,))
+        finally:
+            pool.terminate()
+        rate = result['items'] / result['seconds'] if result['seconds'] else float('inf')
+        print "{stage:<18} {authors:>8} {records:>8} {seconds:>10.3f} {rate:>14,.0f} {peak_mb:>10.1f}".format(
+            rate=rate, **result)
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
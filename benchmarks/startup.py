@@ -0,0 +1,83 @@
+"""
+Benchmark the startup time of wos2vivo.
+
+Imports each module, and runs wos2vivo --help, in fresh processes and
+reports the median time, the number of modules loaded and which heavy
+dependencies were imported. Runs offline.
+
+$ python benchmarks/startup.py
+$ python benchmarks/startup.py --runs 20
+
+The command line tool should start without rdflib, nameparser or
+requests, and without DATA_NAMESPACE set. They are loaded once a
+harvest maps records.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Dependencies that are only needed to harvest, map or serialize.
+HEAVY = ["rdflib", "nameparser", "requests"]
+
+IMPORT = """
+import json, sys, time
+start = time.time()
+import {module}
+elapsed = time.time() - start
+print json.dumps([elapsed, len(sys.modules), [m for m in {heavy!r} if m in sys.modules]])
+"""
+
+HELP = """
+import json, sys, time
+start = time.time()
+from wos2vivo.command import get
+try:
+    get(['--help'])
+except SystemExit:
+    pass
+elapsed = time.time() - start
+print json.dumps([elapsed, len(sys.modules), [m for m in {heavy!r} if m in sys.modules]])
+"""
+
+CASES = [
+    ("import wos2vivo.command", IMPORT.format(module="wos2vivo.command", heavy=HEAVY), False),
+    ("wos2vivo --help", HELP.format(heavy=HEAVY), False),
+    ("import wos2vivo.harvest", IMPORT.format(module="wos2vivo.harvest", heavy=HEAVY), False),
+    ("import wos2vivo.utils", IMPORT.format(module="wos2vivo.utils", heavy=HEAVY), True),
+]
+
+
+def run(code, namespace):
+    """
+    :param code: str Python source
+    :param namespace: boolean set DATA_NAMESPACE
+    :return: (float seconds, int modules, list of heavy modules)
+    """
+    env = dict(os.environ)
+    if namespace:
+        env.setdefault('DATA_NAMESPACE', 'http://vivo.school.edu/individual/')
+    else:
+        env.pop('DATA_NAMESPACE', None)
+    out = subprocess.check_output([sys.executable, "-c", code], env=env)
+    # --help prints the usage before the timings.
+    return json.loads(out.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of wos2vivo.")
+    parser.add_argument('--runs', type=int, default=5, help="Processes started per case.")
+    args = parser.parse_args()
+
+    print "{:<26} {:>10} {:>8}  {}".format("case", "ms", "modules", "heavy imports")
+    for name, code, namespace in CASES:
+        results = sorted(run(code, namespace) for _ in range(args.runs))
+        elapsed, modules, heavy = results[len(results) // 2]
+        print "{:<26} {:>10.1f} {:>8}  {}".format(name, elapsed * 1000, modules, ", ".join(heavy) or "-")
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Build synthetic WoS Lite responses for benchmarking.
+"""
+
+from xml.sax.saxutils import escape
+
+RESPONSE = """<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body><ns2:searchResponse xmlns:ns2="http://woksearchlite.v3.wokmws.thomsonreuters.com"><return><queryId>1</queryId><recordsFound>{found}</recordsFound><recordsSearched>{found}</recordsSearched>{records}</return></ns2:searchResponse></soap:Body></soap:Envelope>"""
+
+FIELD = "<{tag}><label>{label}</label><value>{value}</value></{tag}>"
+
+MONTHS = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
+
+# Records are spread over this many journals, and author names are
+# drawn from a pool so that names repeat across records like they do
+# in collaboration-heavy harvests.
+JOURNALS = 50
+NAMES = 5000
+
+
+def _field(tag, label, value):
+    return FIELD.format(tag=tag, label=label, value=escape(value))
+
+
+def record(num, authors=10):
+    """
+    One records element.
+
+    :param num: int record number, used for the UT
+    :param authors: int number of authors
+    :return: str
+    """
+    journal = num % JOURNALS
+    names = "".join(
+        "<value>Author{}, {}. {}.</value>".format((num + i) % NAMES, chr(65 + i % 26), chr(65 + (i + num) % 26))
+        for i in range(authors)
+    )
+    return "".join([
+        "<records>",
+        "<uid>WOS:{:015d}</uid>".format(num),
+        _field("title", "Title", "Synthetic record {} & the <effects> of benchmarking".format(num)),
+        _field("doctype", "Doctype", "Article"),
+        _field("source", "Issue", str(num % 12 + 1)),
+        _field("source", "Pages", "{}-{}".format(num % 900 + 1, num % 900 + 12)),
+        _field("source", "Published.BiblioDate", "{} {}".format(MONTHS[num % 12], num % 28 + 1)),
+        _field("source", "Published.BiblioYear", str(2000 + num % 17)),
+        _field("source", "SourceTitle", "JOURNAL OF SYNTHETIC RESULTS {}".format(journal)),
+        _field("source", "Volume", str(num % 100 + 1)),
+        "<authors><label>Authors</label>", names, "</authors>",
+        _field("other", "Identifier.Eissn", "1{:03d}-000X".format(journal)),
+        _field("other", "Identifier.Ids", "ID{}".format(num)),
+        _field("other", "Identifier.Issn", "0{:03d}-0000".format(journal)),
+        _field("other", "Identifier.Xref_Doi", "10.5555/synthetic.{}".format(num)),
+        "</records>",
+    ])
+
+
+def page(start, count, found, authors=10):
+    """
+    A query or retrieve response holding records start to
+    start + count - 1.
+
+    :return: str
+    """
+    records = "".join(record(num, authors) for num in range(start, start + count))
+    return RESPONSE.format(found=found, records=records)
+
+
+def pages(found, authors=10, batch_size=100):
+    """
+    The response pages of a query that found a number of records.
+
+    :return: generator of str
+    """
+    for start in range(1, found + 1, batch_size):
+        yield page(start, min(batch_size, found - start + 1), found, authors)
@@ -14,6 +14,8 @@ setup(
     entry_points='''
         [console_scripts]
         wos2vivo=wos2vivo.command:get
+        wos2vivo-batch=wos2vivo.command:batch
+        wos2vivo-lookup=wos2vivo.command:lookup
     ''',
 )
 
@@ -0,0 +1,65 @@
+"""
+Stand-ins for the Web of Science web services shared by the tests.
+"""
+
+from io import BytesIO
+
+import xml.etree.ElementTree as ET
+
+RESPONSE = """<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body><ns2:searchResponse xmlns:ns2="http://woksearchlite.v3.wokmws.thomsonreuters.com"><return><queryId>{query_id}</queryId><recordsFound>{found}</recordsFound><recordsSearched>6737</recordsSearched>{records}</return></ns2:searchResponse></soap:Body></soap:Envelope>"""
+
+RECORD = """<records><uid>WOS:{0:015d}</uid><title><label>Title</label><value>Title {0}</value></title><authors><label>Authors</label><value>Herman, M. P.</value></authors></records>"""
+
+
+class FakeSession(object):
+    """
+    Stand-in for WoSSession that answers Query and Retrieve
+    messages from a fixed number of synthetic records.
+    """
+
+    found = 0
+    generation = 0
+    cache = None
+    # Number of records found for particular user queries.
+    counts = {}
+
+    def __init__(self, *args, **kwargs):
+        self.requests = []
+        self.cache = kwargs.get('cache')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        pass
+
+    def query(self, query_doc):
+        tree = ET.fromstring(query_doc)
+        first = int(tree.find(".//firstRecord").text)
+        count = int(tree.find(".//count").text)
+        self.requests.append(first)
+        # Use the user query as query id to answer retrieves.
+        user_query = tree.find(".//userQuery")
+        if user_query is not None:
+            query_id = user_query.text
+        else:
+            query_id = tree.find(".//queryId").text
+        found = self.counts.get(query_id, self.found)
+        last = min(first + count, found + 1)
+        records = "".join(RECORD.format(n) for n in range(first, last))
+        return RESPONSE.format(query_id=query_id, found=found, records=records)
+
+    def query_stream(self, query_doc):
+        return FakeResponse(self.query(query_doc))
+
+    def query_content(self, query_doc):
+        return self.query(query_doc)
+
+
+class FakeResponse(object):
+
+    def __init__(self, body):
+        self.raw = BytesIO(body)
+
+    def close(self):
+        self.raw.close()
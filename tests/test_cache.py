@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from wos2vivo.cache import ResponseCache
+
+
+class TestResponseCache(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_get_set(self):
+        cache = ResponseCache(self.tmp)
+        self.assertEqual(cache.get("a"), None)
+        cache.set("a", "<response/>" * 100)
+        self.assertEqual(cache.get("a"), "<response/>" * 100)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # Stored compressed.
+        self.assertTrue(os.path.getsize(cache._path("a")) < 100)
+
+    def test_ttl(self):
+        cache = ResponseCache(self.tmp, ttl=60)
+        cache.set("a", "old")
+        os.utime(cache._path("a"), (time.time() - 120, time.time() - 120))
+        self.assertEqual(cache.get("a"), None)
+        self.assertFalse(os.path.exists(cache._path("a")))
+
+    def test_evict_least_recently_used(self):
+        cache = ResponseCache(self.tmp)
+        for num, key in enumerate(["a", "b", "c"]):
+            cache.set(key, os.urandom(1000))
+            os.utime(cache._path(key), (1000 + num, time.time()))
+        # Reading "a" makes "b" the least recently used.
+        self.assertTrue(cache.get("a") is not None)
+        cache.max_bytes = 2500
+        cache.evict()
+        self.assertEqual([cache.get(key) is not None for key in ["a", "b", "c"]], [True, False, True])
+
+    def test_size_counted_once(self):
+        cache = ResponseCache(self.tmp, max_bytes=2500)
+        scans = []
+        evict = cache.evict
+        cache.evict = lambda: scans.append(1) or evict()
+        for num, key in enumerate(["a", "b", "c", "b"]):
+            cache.set(key, os.urandom(1000))
+            os.utime(cache._path(key), (1000 + num, time.time()))
+        # Counted on the first write and again when "c" did not fit.
+        self.assertEqual(len(scans), 2)
+        self.assertEqual([cache.get(key) is not None for key in ["a", "b", "c"]], [False, True, True])
@@ -0,0 +1,116 @@
+import time
+from io import BytesIO
+from unittest import TestCase
+
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.exceptions import ConnectionError
+
+from wos2vivo import constants
+from wos2vivo.client import WoSSession, RateLimiter, SessionExpired
+
+FAULT = '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body><soap:Fault><faultcode>soap:Server</faultcode><faultstring>{}</faultstring></soap:Fault></soap:Body></soap:Envelope>'
+
+RETRIEVE = '<retrieve><queryId>1</queryId></retrieve>'
+
+OK = '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body><return><queryId>1</queryId><recordsFound>0</recordsFound></return></soap:Body></soap:Envelope>'
+
+
+class FakeAdapter(BaseAdapter):
+    """
+    Transport that answers requests from a list of (status, body)
+    pairs or exceptions, and records the URLs requested.
+    """
+
+    def __init__(self, answers):
+        super(FakeAdapter, self).__init__()
+        self.answers = list(answers)
+        self.urls = []
+
+    def send(self, request, **kwargs):
+        self.urls.append(request.url)
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        status, body = answer
+        rsp = Response()
+        rsp.status_code = status
+        rsp.raw = BytesIO(body)
+        rsp.request = request
+        rsp.url = request.url
+        return rsp
+
+    def close(self):
+        pass
+
+
+class TestWoSSession(TestCase):
+
+    def session(self, answers, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        kwargs.setdefault('per_second', None)
+        session = WoSSession(**kwargs)
+        self.adapter = FakeAdapter(answers)
+        session.mount('http://', self.adapter)
+        return session
+
+    def test_retry_transient_failures(self):
+        session = self.session([
+            ConnectionError("reset"),
+            (503, "unavailable"),
+            (500, FAULT.format("Request denied by Throttle server")),
+            (200, OK),
+        ])
+        self.assertEqual(session.query("<query/>"), OK)
+        self.assertEqual(session.retried, 3)
+
+    def test_give_up_after_retries(self):
+        session = self.session([(503, "unavailable")] * 3, retries=2)
+        with self.assertRaises(Exception):
+            session.query_stream("<query/>")
+        self.assertEqual(len(self.adapter.urls), 3)
+
+    def test_other_faults_not_retried(self):
+        session = self.session([(500, FAULT.format("Invalid query"))])
+        self.assertIn("Invalid query", session.query("<query/>"))
+        self.assertEqual(session.retried, 0)
+
+    def test_expired_session_authenticates_again(self):
+        session = self.session([
+            (500, FAULT.format("(SessionServer) There is a problem with your session identifier (SID).")),
+            (200, "<authenticated/>"),
+        ])
+        with self.assertRaises(SessionExpired):
+            session.query(RETRIEVE)
+        self.assertEqual(self.adapter.urls, [constants.SEARCH_URL, constants.AUTH_URL])
+
+    def test_expired_session_query_sent_again(self):
+        session = self.session([
+            (500, FAULT.format("(SessionServer) There is a problem with your session identifier (SID).")),
+            (200, "<authenticated/>"),
+            (200, OK),
+        ])
+        self.assertEqual(session.query("<query/>"), OK)
+        self.assertEqual(self.adapter.urls, [constants.SEARCH_URL, constants.AUTH_URL, constants.SEARCH_URL])
+
+    def test_session_limit(self):
+        session = self.session([(200, OK), (200, "<authenticated/>"), (200, OK), (200, "<authenticated/>"), (200, OK)],
+                               session_limit=1)
+        session.query(RETRIEVE)
+        with self.assertRaises(SessionExpired):
+            session.query(RETRIEVE)
+        session.query(RETRIEVE)
+        # Query messages go to the new session without an error.
+        session.query("<query/>")
+        self.assertEqual(self.adapter.urls, [constants.SEARCH_URL, constants.AUTH_URL, constants.SEARCH_URL,
+                                             constants.AUTH_URL, constants.SEARCH_URL])
+
+
+class TestRateLimiter(TestCase):
+
+    def test_spacing(self):
+        limiter = RateLimiter(per_second=20)
+        start = time.time()
+        for _ in range(5):
+            limiter.wait()
+        self.assertTrue(time.time() - start >= 0.19)
@@ -0,0 +1,83 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from wos2vivo import harvest
+from wos2vivo.command import get, read_batch
+
+from tests.fakes import FakeSession
+
+
+class TestReadBatch(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "orgs.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_read_batch(self):
+        with open(self.path, "w") as f:
+            f.write("# Harvest list\n")
+            f.write("University of Florida\n")
+            f.write("\n")
+            f.write("University of Florida Health, 2016-03-01, 2016-03-31\n")
+            f.write('"Shands Hospital, Gainesville",,\n')
+        self.assertEqual(read_batch(self.path, "2"), [
+            dict(name="University of Florida", weeks=2),
+            dict(name="University of Florida Health", span=dict(begin="2016-03-01", end="2016-03-31")),
+            dict(name="Shands Hospital, Gainesville", weeks=2),
+        ])
+
+
+class TestStartup(TestCase):
+
+    def test_lazy_imports(self):
+        # The command starts without the mapping dependencies and
+        # without DATA_NAMESPACE.
+        env = dict(os.environ)
+        env.pop('DATA_NAMESPACE', None)
+        code = "import sys, wos2vivo.command; print sorted(m for m in ['rdflib', 'nameparser', 'requests'] if m in sys.modules)"
+        self.assertEqual(subprocess.check_output([sys.executable, "-c", code], env=env).strip(), "[]")
+
+
+class TestCheckpointOutput(TestCase):
+
+    def setUp(self):
+        self.session = harvest.WoSSession
+        harvest.WoSSession = FakeSession
+        FakeSession.found = 230
+        self.tmp = tempfile.mkdtemp()
+        self.out = os.path.join(self.tmp, "pubs.nt")
+        self.checkpoint = os.path.join(self.tmp, "checkpoint.json")
+
+    def tearDown(self):
+        harvest.WoSSession = self.session
+        FakeSession.found = 0
+        shutil.rmtree(self.tmp)
+
+    def run_get(self):
+        result = CliRunner().invoke(get, [
+            "Test", "--begin", "2016-01-01", "--end", "2016-12-31", "--stream", "--format", "nt",
+            "--file", self.out, "--checkpoint", self.checkpoint
+        ])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with open(self.out) as f:
+            return f.read().splitlines()
+
+    def test_rerun_keeps_output(self):
+        first = self.run_get()
+        self.assertGreater(len(first), 0)
+        FakeSession.found = 240
+        second = self.run_get()
+        self.assertEqual(second[:len(first)], first)
+        # Only the new records are added.
+        added = "\n".join(second[len(first):])
+        self.assertIn("<http://vivo.school.edu/individual/pub-WOS-000000000000240>", added)
+        self.assertNotIn("<http://vivo.school.edu/individual/pub-WOS-000000000000230>", added)
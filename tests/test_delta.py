@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import TestCase
+
+import xml.etree.ElementTree as ET
+
+from wos2vivo.delta import Delta, DeltaStore
+from wos2vivo.record import Record
+
+with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'record.xml')) as f:
+    RECORD = f.read()
+
+
+def record(volume="94", venue="INTERNATIONAL JOURNAL OF RADIATION ONCOLOGY BIOLOGY PHYSICS"):
+    root = ET.fromstring(RECORD)
+    for item in root.findall('source'):
+        if item.find('label').text == 'Volume':
+            item.find('value').text = volume
+        elif item.find('label').text == 'SourceTitle':
+            item.find('value').text = venue
+    return Record(root)
+
+
+class TestDelta(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = DeltaStore(os.path.join(self.tmp, 'exported.db'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp)
+
+    def run_delta(self, rec):
+        additions, retractions = BytesIO(), BytesIO()
+        delta = Delta(self.store, additions, retractions)
+        delta.write(rec)
+        return delta, additions.getvalue().splitlines(), retractions.getvalue().splitlines()
+
+    def test_new(self):
+        delta, added, retracted = self.run_delta(record())
+        self.assertEqual((delta.new, delta.changed, delta.unchanged), (1, 0, 0))
+        self.assertEqual(len(added), len(record().to_rdf()))
+        self.assertEqual(retracted, [])
+
+    def test_unchanged(self):
+        self.run_delta(record())
+        delta, added, retracted = self.run_delta(record())
+        self.assertEqual((delta.new, delta.changed, delta.unchanged), (0, 0, 1))
+        self.assertEqual((added, retracted), ([], []))
+
+    def test_changed(self):
+        self.run_delta(record())
+        delta, added, retracted = self.run_delta(record(volume="95"))
+        self.assertEqual((delta.new, delta.changed, delta.unchanged), (0, 1, 0))
+        self.assertEqual(len(added), 1)
+        self.assertTrue('"95"' in added[0])
+        self.assertEqual(len(retracted), 1)
+        self.assertTrue('"94"' in retracted[0])
+
+    def test_shared_venue_kept(self):
+        self.run_delta(record())
+        delta, added, retracted = self.run_delta(record(venue="INT J RADIAT ONCOL"))
+        # The new journal label is added, the old one belongs to a
+        # journal other records may share and is not retracted.
+        self.assertEqual(len(added), 1)
+        self.assertTrue("INT J RADIAT ONCOL" in added[0])
+        self.assertEqual(retracted, [])
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import xml.etree.ElementTree as ET
+
+from rdflib import Graph, Literal, URIRef, BNode, RDFS, XSD
+from rdflib.compare import isomorphic
+
+from wos2vivo.encoder import Encoder
+from wos2vivo.record import Record, D
+from wos2vivo.utils import encoder, output_graph
+
+with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'record.xml')) as f:
+    RECORD = f.read()
+
+
+class TestEncoder(TestCase):
+
+    def setUp(self):
+        self.g = Record(ET.fromstring(RECORD)).to_rdf()
+        pub = D['pub-WOS-000371581900197']
+        self.g.add((pub, RDFS.comment, Literal(u'Line one\nline "two" \\ caf\xe9 \U0001F600')))
+        self.g.add((pub, RDFS.comment, Literal(u"Résumé", lang="fr")))
+        self.g.add((pub, RDFS.seeAlso, BNode("b1")))
+        self.g.add((pub, RDFS.seeAlso, URIRef("http://example.org/other#x.y")))
+
+    def test_ntriples_identical(self):
+        self.assertEqual(output_graph(self.g, format="nt"), self.g.serialize(format="nt"))
+
+    def test_turtle(self):
+        out = output_graph(self.g, format="turtle")
+        self.assertTrue("d:pub-WOS-000371581900197 a bibo:AcademicArticle ;" in out)
+        self.assertTrue('"2016-01-01T00:00:00"^^xsd:dateTime' in out)
+        # Not a valid local name, written in full.
+        self.assertTrue("<http://example.org/other#x.y>" in out)
+        parsed = Graph()
+        parsed.parse(data=out, format="turtle")
+        self.assertTrue(isomorphic(parsed, self.g))
+
+    def test_destination(self):
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, 'out.nt')
+        try:
+            output_graph(self.g, destination=path, format="nt")
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), self.g.serialize(format="nt"))
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_fallback(self):
+        g = Graph()
+        g.add((URIRef("http://example.org/a b"), RDFS.label, Literal("a")))
+        with self.assertRaises(ValueError):
+            b"".join(encoder.ntriples(g))
+        # rdflib refuses the URI too.
+        with self.assertRaises(Exception):
+            output_graph(g, format="nt")
+        # Other formats are written by rdflib.
+        self.assertTrue("rdf:RDF" in output_graph(self.g, format="xml"))
+
+    def test_longest_namespace(self):
+        enc = Encoder([("ex", "http://example.org/"), ("exv", "http://example.org/vocab/")])
+        self.assertEqual(enc.turtle_term(URIRef("http://example.org/vocab/name")), "exv:name")
+        self.assertEqual(enc.turtle_term(URIRef("http://example.org/name")), "ex:name")
+        self.assertEqual(enc.turtle_term(Literal("1", datatype=XSD.integer)), '"1"^^<http://www.w3.org/2001/XMLSchema#integer>')
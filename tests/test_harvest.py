@@ -0,0 +1,362 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from itertools import islice
+from unittest import TestCase
+
+import xml.etree.ElementTree as ET
+
+from wos2vivo import harvest
+from wos2vivo.cache import ResponseCache
+from wos2vivo.checkpoint import Checkpoint
+from wos2vivo.client import SessionExpired
+
+from tests.fakes import FakeResponse, FakeSession, RECORD, RESPONSE
+
+
+class ExpiringSession(FakeSession):
+    """
+    Session that expires once, on the Retrieve of the given offset.
+    Query ids of the expired session are refused afterwards.
+    """
+
+    expire_at = 101
+
+    def __init__(self, *args, **kwargs):
+        super(ExpiringSession, self).__init__(*args, **kwargs)
+        self.generation = 0
+
+    def query(self, query_doc):
+        tree = ET.fromstring(query_doc)
+        query_id = tree.find(".//queryId")
+        if query_id is not None:
+            first = int(tree.find(".//firstRecord").text)
+            if first == self.expire_at and self.generation == 0:
+                self.generation += 1
+                raise SessionExpired("expired")
+            if query_id.text != str(self.generation):
+                raise Exception("Unknown query id {}.".format(query_id.text))
+            query_doc = query_doc.replace(
+                "<queryId>{}</queryId>".format(query_id.text),
+                "<queryId>OG=Test</queryId>"
+            )
+        rsp = super(ExpiringSession, self).query(query_doc)
+        return rsp.replace("<queryId>OG=Test</queryId>", "<queryId>{}</queryId>".format(self.generation))
+
+
+FAULT = '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body><soap:Fault><faultcode>soap:Server</faultcode><faultstring>{}</faultstring></soap:Fault></soap:Body></soap:Envelope>'
+
+
+class FaultSession(ExpiringSession):
+    """
+    Session where another thread starts a new session just before
+    the Retrieve of the given offset. The old query id is answered
+    with a fault body, like WoSSession.query does for a 500 response,
+    and query_content and query_stream raise on it.
+    """
+
+    def query(self, query_doc):
+        tree = ET.fromstring(query_doc)
+        query_id = tree.find(".//queryId")
+        if query_id is not None and int(tree.find(".//firstRecord").text) == self.expire_at and self.generation == 0:
+            self.generation += 1
+        try:
+            return super(FaultSession, self).query(query_doc)
+        except Exception as e:
+            return FAULT.format(e)
+
+    def query_content(self, query_doc):
+        body = self.query(query_doc)
+        if "<soap:Fault>" in body:
+            raise Exception(body)
+        return body
+
+    def query_stream(self, query_doc):
+        return FakeResponse(self.query_content(query_doc))
+
+
+class TestGetPublications(TestCase):
+
+    def setUp(self):
+        self.session = harvest.WoSSession
+        harvest.WoSSession = FakeSession
+
+    def tearDown(self):
+        harvest.WoSSession = self.session
+
+    def uts(self, limit=None, **kwargs):
+        records = harvest.get_publications("OG=Test", weeks=1, **kwargs)
+        return [int(rec.ut().split(':')[1]) for rec in islice(records, limit)]
+
+    def test_sequential_pages(self):
+        FakeSession.found = 250
+        self.assertEqual(self.uts(), list(range(1, 251)))
+
+    def test_last_record_on_its_own_page(self):
+        FakeSession.found = 101
+        self.assertEqual(self.uts(), list(range(1, 102)))
+
+    def test_concurrent_pages_in_order(self):
+        FakeSession.found = 1234
+        self.assertEqual(self.uts(batch_size=10, workers=4), list(range(1, 1235)))
+
+    def test_concurrent_single_page(self):
+        FakeSession.found = 7
+        self.assertEqual(self.uts(workers=4), list(range(1, 8)))
+
+    def test_expired_session_renews_query(self):
+        harvest.WoSSession = ExpiringSession
+        FakeSession.found = 230
+        self.assertEqual(self.uts(batch_size=50), list(range(1, 231)))
+        self.assertEqual(self.uts(batch_size=50, workers=3), list(range(1, 231)))
+
+    def test_fault_renews_query(self):
+        # The id went stale in another thread, so the Retrieve gets a
+        # fault response rather than SessionExpired.
+        harvest.WoSSession = FaultSession
+        FakeSession.found = 230
+        self.assertEqual(self.uts(batch_size=50, workers=3), list(range(1, 231)))
+
+    def test_orgs_deduplicated(self):
+        FakeSession.counts = {"OG=A": 130, "OG=B": 250, "OG=C": 20}
+        orgs = [
+            dict(name="A", weeks=1),
+            dict(name="B", span=dict(begin="2016-01-01", end="2016-12-31")),
+            dict(name="C", weeks=2),
+        ]
+        records = harvest.get_publications_for_orgs(orgs, batch_size=50, parallel=3)
+        uts = [int(rec.ut().split(':')[1]) for rec in records]
+        FakeSession.counts = {}
+        self.assertEqual(uts, list(range(1, 251)))
+
+    def test_orgs_bounded(self):
+        # Organizations are not harvested further ahead of the
+        # consumer than their queues hold.
+        harvest.WoSSession = LoggingSession
+        LoggingSession.sent = []
+        FakeSession.counts = dict(("OG={}".format(n), 2000) for n in range(5))
+        orgs = [dict(name=str(n), weeks=1) for n in range(5)]
+        records = harvest.get_publications_for_orgs(orgs, batch_size=50, parallel=2)
+        try:
+            self.assertEqual(len(list(islice(records, 10))), 10)
+            time.sleep(0.3)
+            self.assertTrue(len(LoggingSession.sent) < 20)
+        finally:
+            records.close()
+            FakeSession.counts = {}
+
+
+class SpanSession(FakeSession):
+    """
+    Session that finds PER_DAY records on every day from 2016-01-01,
+    numbered in date order.
+    """
+
+    PER_DAY = 10
+    START = date(2016, 1, 1)
+
+    def query(self, query_doc):
+        tree = ET.fromstring(query_doc)
+        first = int(tree.find(".//firstRecord").text)
+        count = int(tree.find(".//count").text)
+        query_id = tree.find(".//queryId")
+        if query_id is not None:
+            begin, end = query_id.text.split('/')
+        else:
+            begin, end = tree.find(".//timeSpan/begin").text, tree.find(".//timeSpan/end").text
+        self.requests.append((begin, end, first))
+        offset = (datetime.strptime(begin, "%Y-%m-%d").date() - self.START).days * self.PER_DAY
+        found = ((datetime.strptime(end, "%Y-%m-%d") - datetime.strptime(begin, "%Y-%m-%d")).days + 1) * self.PER_DAY
+        last = min(first + count, found + 1)
+        records = "".join(RECORD.format(offset + n) for n in range(first, last))
+        return RESPONSE.format(query_id=begin + '/' + end, found=found, records=records)
+
+
+class CountingSpanSession(SpanSession):
+    """
+    SpanSession that keeps the page size of the messages sent by all
+    its instances.
+    """
+
+    counts = []
+
+    def query(self, query_doc):
+        self.counts.append(int(ET.fromstring(query_doc).find(".//count").text))
+        return super(CountingSpanSession, self).query(query_doc)
+
+
+class TestSplit(TestCase):
+
+    def setUp(self):
+        self.session = harvest.WoSSession
+        harvest.WoSSession = SpanSession
+
+    def tearDown(self):
+        harvest.WoSSession = self.session
+
+    def test_split_span(self):
+        self.assertEqual(
+            harvest._split_span(dict(begin="2016-01-01", end="2016-01-10")),
+            (dict(begin="2016-01-01", end="2016-01-05"), dict(begin="2016-01-06", end="2016-01-10"))
+        )
+        self.assertEqual(harvest._split_span(dict(begin="2016-01-01", end="2016-01-01")), None)
+
+    def test_plan_spans(self):
+        spans = harvest.plan_spans(SpanSession(), "OG=Test", dict(begin="2016-01-01", end="2016-01-31"), limit=100)
+        self.assertTrue(all(found <= 100 for span, found in spans))
+        self.assertEqual(sum(found for span, found in spans), 310)
+        # Consecutive spans cover the whole span.
+        self.assertEqual(spans[0][0]['begin'], "2016-01-01")
+        self.assertEqual(spans[-1][0]['end'], "2016-01-31")
+        for (before, _), (after, _) in zip(spans, spans[1:]):
+            self.assertEqual(
+                datetime.strptime(after['begin'], "%Y-%m-%d") - datetime.strptime(before['end'], "%Y-%m-%d"),
+                timedelta(days=1)
+            )
+
+    def test_single_day_over_limit(self):
+        spans = harvest.plan_spans(SpanSession(), "OG=Test", dict(begin="2016-01-01", end="2016-01-02"), limit=5)
+        self.assertEqual(spans, [
+            (dict(begin="2016-01-01", end="2016-01-01"), 10),
+            (dict(begin="2016-01-02", end="2016-01-02"), 10),
+        ])
+
+    def test_split_harvest(self):
+        orgs = [dict(name="Test", span=dict(begin="2016-01-01", end="2016-03-31"))]
+        records = harvest.get_publications_for_orgs(orgs, batch_size=25, parallel=3, split=True, limit=100)
+        uts = [int(rec.ut().split(':')[1]) for rec in records]
+        self.assertEqual(uts, list(range(1, 911)))
+
+    def test_split_harvest_streams(self):
+        # Sub-spans are harvested as their records are consumed.
+        harvest.WoSSession = CountingSpanSession
+        CountingSpanSession.counts = []
+        orgs = [dict(name="Test", span=dict(begin="2016-01-01", end="2016-03-31"))]
+        records = harvest.get_publications_for_orgs(orgs, batch_size=25, split=True, limit=100)
+        self.assertEqual(len(list(islice(records, 5))), 5)
+        # The spans were counted and only the first page read.
+        self.assertEqual([count for count in CountingSpanSession.counts if count != 1], [25])
+        records.close()
+
+
+class TestCheckpoint(TestCase):
+
+    def setUp(self):
+        self.session = harvest.WoSSession
+        harvest.WoSSession = FakeSession
+        FakeSession.found = 230
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "checkpoint.json")
+
+    def tearDown(self):
+        harvest.WoSSession = self.session
+        shutil.rmtree(self.tmp)
+
+    def uts(self, limit=None, workers=1):
+        records = harvest.get_publications(
+            "OG=Test",
+            span=dict(begin="2016-01-01", end="2016-12-31"),
+            batch_size=50,
+            workers=workers,
+            checkpoint=Checkpoint(self.path)
+        )
+        return [int(rec.ut().split(':')[1]) for rec in islice(records, limit)]
+
+    def test_resume_after_last_completed_page(self):
+        self.assertEqual(self.uts(limit=120), list(range(1, 121)))
+        checkpoint = Checkpoint(self.path)
+        self.assertEqual(checkpoint.offset, 51)
+        self.assertTrue(checkpoint.resumes("OG=Test", span=dict(begin="2016-01-01", end="2016-12-31")))
+        self.assertEqual(self.uts(workers=2), list(range(101, 231)))
+        self.assertTrue(Checkpoint(self.path).complete)
+
+    def test_skip_exported_records(self):
+        self.assertEqual(len(self.uts()), 230)
+        FakeSession.found = 260
+        self.assertEqual(self.uts(), list(range(231, 261)))
+
+    def test_uts_appended(self):
+        synced = []
+        checkpoint = Checkpoint(self.path)
+        checkpoint.sync = lambda: synced.append(checkpoint.offset)
+        records = harvest.get_publications(
+            "OG=Test",
+            span=dict(begin="2016-01-01", end="2016-12-31"),
+            batch_size=50,
+            checkpoint=checkpoint
+        )
+        list(islice(records, 120))
+        # The output is flushed before every page is saved.
+        self.assertEqual(synced, [1, 51])
+        with open(self.path) as f:
+            self.assertNotIn('uts', json.load(f))
+        with open(self.path + '.uts') as f:
+            self.assertEqual(len(f.read().splitlines()), 100)
+
+    def test_load_uts_from_state(self):
+        # Checkpoints written before the UTs file kept the UTs in the state.
+        with open(self.path, 'w') as f:
+            json.dump(dict(query="OG=Test", weeks=None, span=None, offset=0, complete=True,
+                           uts=["WOS:000000000000001"]), f)
+        checkpoint = Checkpoint(self.path)
+        self.assertTrue(checkpoint.seen("WOS:000000000000001"))
+        checkpoint.page_done(1, ["WOS:000000000000002"])
+        self.assertEqual(Checkpoint(self.path).uts, set(["WOS:000000000000001", "WOS:000000000000002"]))
+
+    def test_new_query_starts_over(self):
+        self.uts(limit=120)
+        checkpoint = Checkpoint(self.path)
+        self.assertFalse(checkpoint.resumes("OG=Other", weeks=1))
+        self.assertEqual(checkpoint.begin("OG=Other", weeks=1), 0)
+        self.assertFalse(checkpoint.seen("WOS:000000000000001"))
+
+
+class LoggingSession(FakeSession):
+    """
+    Session that counts the messages sent by all its instances.
+    """
+
+    sent = []
+
+    def query(self, query_doc):
+        self.sent.append(query_doc)
+        return super(LoggingSession, self).query(query_doc)
+
+
+class TestResponseCache(TestCase):
+
+    def setUp(self):
+        self.session = harvest.WoSSession
+        harvest.WoSSession = LoggingSession
+        LoggingSession.found = 230
+        del LoggingSession.sent[:]
+        self.tmp = tempfile.mkdtemp()
+        self.cache = ResponseCache(self.tmp)
+
+    def tearDown(self):
+        harvest.WoSSession = self.session
+        shutil.rmtree(self.tmp)
+
+    def uts(self, **kwargs):
+        records = harvest.get_publications("OG=Test", weeks=1, batch_size=50, cache=self.cache, **kwargs)
+        return [int(rec.ut().split(':')[1]) for rec in records]
+
+    def test_second_run_from_cache(self):
+        self.assertEqual(self.uts(), list(range(1, 231)))
+        self.assertEqual(len(LoggingSession.sent), 5)
+        self.assertEqual(self.uts(workers=2), list(range(1, 231)))
+        self.assertEqual(len(LoggingSession.sent), 5)
+        self.assertEqual(self.cache.hits, 5)
+
+    def test_missing_page_runs_query(self):
+        self.uts()
+        os.remove(self.cache._path(u"{}|firstRecord=101".format(
+            harvest.Query("OG=Test", weeks=1, count=50).cache_key()
+        )))
+        del LoggingSession.sent[:]
+        self.assertEqual(self.uts(), list(range(1, 231)))
+        # The query for a new query id, then the missing page.
+        self.assertEqual(len(LoggingSession.sent), 2)
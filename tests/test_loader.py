@@ -0,0 +1,114 @@
+import os
+import threading
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from unittest import TestCase
+
+import xml.etree.ElementTree as ET
+
+from wos2vivo.loader import SparqlLoader
+from wos2vivo.record import Record
+
+with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'record.xml')) as f:
+    RECORD = f.read()
+
+
+class Endpoint(ThreadingMixIn, HTTPServer):
+    """
+    Stand-in triple store that keeps the requests it was sent and
+    fails the first `failures` of them with a 503.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, failures=0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), EndpointHandler)
+        self.failures = failures
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/sparql".format(self.server_port)
+
+
+class EndpointHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        with self.server.lock:
+            fail = self.server.failures > 0
+            if fail:
+                self.server.failures -= 1
+            else:
+                self.server.requests.append((self.path, self.headers['Content-Type'], body))
+        self.send_response(503 if fail else 204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSparqlLoader(TestCase):
+
+    def setUp(self):
+        self.rec = Record(ET.fromstring(RECORD))
+        self.triples = len(self.rec.to_rdf())
+
+    def serve(self, failures=0):
+        self.endpoint = Endpoint(failures)
+        thread = threading.Thread(target=self.endpoint.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.endpoint.server_close)
+        self.addCleanup(self.endpoint.shutdown)
+        return self.endpoint
+
+    def load(self, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        with SparqlLoader(self.endpoint.url, **kwargs) as loader:
+            for _ in range(3):
+                loader.write(self.rec.to_rdf())
+        return loader
+
+    def test_update_batches(self):
+        self.serve()
+        loader = self.load(batch_size=10, workers=3, graph="http://example.org/wos")
+        self.assertEqual(loader.triples, self.triples * 3)
+        self.assertEqual(loader.batches, len(self.endpoint.requests))
+        loaded = 0
+        for path, content_type, body in self.endpoint.requests:
+            self.assertEqual(content_type, "application/sparql-update")
+            self.assertTrue(body.startswith("INSERT DATA { GRAPH <http://example.org/wos> {"))
+            loaded += len([l for l in body.splitlines() if l.endswith(" .")])
+        self.assertEqual(loaded, self.triples * 3)
+
+    def test_graph_store(self):
+        self.serve()
+        self.load(protocol="graph-store", batch_size=1000, graph="http://example.org/wos")
+        self.assertEqual(len(self.endpoint.requests), 1)
+        path, content_type, body = self.endpoint.requests[0]
+        self.assertEqual(content_type, "application/n-triples")
+        self.assertEqual(urlparse.parse_qs(urlparse.urlparse(path).query), {"graph": ["http://example.org/wos"]})
+        self.assertEqual(len(body.splitlines()), self.triples * 3)
+
+    def test_vivo_credentials(self):
+        self.serve()
+        self.load(batch_size=1000, email="vivo_root@school.edu", password="xxx")
+        path, content_type, body = self.endpoint.requests[0]
+        form = urlparse.parse_qs(body)
+        self.assertEqual(form['email'], ["vivo_root@school.edu"])
+        self.assertTrue(form['update'][0].startswith("INSERT DATA {"))
+
+    def test_retry_failed_batch(self):
+        self.serve(failures=2)
+        loader = self.load(batch_size=1000)
+        self.assertEqual(loader.retried, 2)
+        self.assertEqual(len(self.endpoint.requests), 1)
+
+    def test_failed_batch_raises(self):
+        self.serve(failures=10)
+        with self.assertRaises(Exception):
+            self.load(batch_size=1000, retries=1)
@@ -0,0 +1,90 @@
+import re
+from unittest import TestCase
+
+import xml.etree.ElementTree as ET
+
+from wos2vivo import lookup
+from wos2vivo.lookup import Lookup, normalize, pack_queries
+
+from tests.fakes import FakeSession, RESPONSE
+
+RECORD = """<records><uid>{ut}</uid><title><label>Title</label><value>Title</value></title><authors><label>Authors</label><value>Herman, M. P.</value></authors>{doi}</records>"""
+
+DOI = """<other><label>Identifier.Doi</label><value>{}</value></other>"""
+
+
+class IdentifierSession(FakeSession):
+    """
+    Session that finds a record for every identifier of a query
+    except the ones in missing.
+    """
+
+    missing = set()
+    queries = []
+
+    def query(self, query_doc):
+        tree = ET.fromstring(query_doc)
+        first = int(tree.find(".//firstRecord").text)
+        count = int(tree.find(".//count").text)
+        user_query = tree.find(".//userQuery")
+        if user_query is not None:
+            query_id = user_query.text
+            self.queries.append(query_id)
+        else:
+            query_id = tree.find(".//queryId").text
+        records = []
+        for value in re.findall(r'"([^"]+)"', query_id):
+            if value in self.missing:
+                continue
+            if query_id.startswith("DO="):
+                # DOIs are stored in upper case by some publishers.
+                records.append(RECORD.format(ut="WOS:DOI-" + value, doi=DOI.format(value.upper())))
+            else:
+                records.append(RECORD.format(ut=value, doi=""))
+        page = "".join(records[first - 1:first - 1 + count])
+        return RESPONSE.format(query_id=query_id, found=len(records), records=page)
+
+
+class TestLookup(TestCase):
+
+    def setUp(self):
+        self.session = lookup.WoSSession
+        lookup.WoSSession = IdentifierSession
+        IdentifierSession.queries = []
+
+    def tearDown(self):
+        lookup.WoSSession = self.session
+        IdentifierSession.missing = set()
+
+    def test_normalize(self):
+        self.assertEqual(normalize(" 10.1016/J.IJROBP.2015.12.247 "), ("DO", "10.1016/j.ijrobp.2015.12.247"))
+        self.assertEqual(normalize("https://doi.org/10.1016/S0165-1765(99)00249-9"), ("DO", "10.1016/s0165-1765(99)00249-9"))
+        self.assertEqual(normalize("000371581900197"), ("UT", "WOS:000371581900197"))
+        self.assertEqual(normalize("wos:000371581900197"), ("UT", "WOS:000371581900197"))
+        self.assertEqual(normalize(""), None)
+
+    def test_pack_queries(self):
+        values = ["10.1/{:04d}".format(n) for n in range(100)]
+        queries = pack_queries("DO", values, length=200)
+        self.assertTrue(len(queries) > 1)
+        self.assertTrue(all(len(q) <= 200 for q in queries))
+        self.assertEqual(queries[0][:14], 'DO=("10.1/0000')
+        self.assertEqual(re.findall(r'"([^"]+)"', " ".join(queries)), values)
+        # Too long for the limit on its own.
+        self.assertEqual(pack_queries("UT", ["WOS:000371581900197"], length=10), ['UT=("WOS:000371581900197")'])
+
+    def test_lookup(self):
+        uts = ["WOS:{:015d}".format(n) for n in range(1, 121)]
+        dois = ["10.1000/{}".format(n) for n in range(30)]
+        IdentifierSession.missing = set([uts[5], dois[7]])
+        # The last UT is the record of a DOI in the list.
+        finder = Lookup(uts + dois + [uts[0], "WOS:DOI-10.1000/3", '10.1/"quoted"'], length=500)
+        records = list(finder.records(batch_size=10, workers=2, parallel=3))
+        # One query per batch of identifiers, not per identifier.
+        self.assertEqual(len(IdentifierSession.queries), len(finder.queries))
+        self.assertTrue(len(finder.queries) < 20)
+        self.assertEqual(len(finder.identifiers), 151)
+        # Records found by more than one query are returned once.
+        self.assertEqual(len(records), 148)
+        self.assertEqual(finder.not_found, [uts[5], dois[7]])
+        self.assertEqual(finder.invalid, ['10.1/"quoted"'])
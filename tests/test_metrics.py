@@ -0,0 +1,63 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from wos2vivo import harvest
+from wos2vivo.metrics import Metrics, metrics
+
+from tests.fakes import FakeSession
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_counters_and_timers(self):
+        m = Metrics()
+        m.incr('requests')
+        m.incr('requests', 2)
+        m.observe('map_seconds', 0.5)
+        m.observe('map_seconds', 3.0, count=2)
+        with m.timer('query_seconds'):
+            pass
+        summary = m.summary()
+        self.assertEqual(summary['requests'], 3)
+        self.assertEqual(summary['map_seconds'], dict(count=3, total=3.5, mean=round(3.5 / 3, 6), max=1.5))
+        self.assertEqual(summary['query_seconds']['count'], 1)
+        m.reset()
+        self.assertEqual(m.summary()['requests'], 0)
+
+    def test_save(self):
+        m = Metrics()
+        m.incr('triples', 42)
+        m.observe('serialize_seconds', 0.25)
+        m.save(os.path.join(self.tmp, 'metrics.json'))
+        with open(os.path.join(self.tmp, 'metrics.json')) as f:
+            self.assertEqual(json.load(f)['triples'], 42)
+        m.save(os.path.join(self.tmp, 'wos2vivo.prom'))
+        with open(os.path.join(self.tmp, 'wos2vivo.prom')) as f:
+            lines = f.read().splitlines()
+        self.assertTrue("# TYPE wos2vivo_triples_total counter" in lines)
+        self.assertTrue("wos2vivo_triples_total 42" in lines)
+        self.assertTrue("wos2vivo_serialize_seconds_sum 0.25" in lines)
+        # No temporary files left behind.
+        self.assertEqual(sorted(os.listdir(self.tmp)), ['metrics.json', 'wos2vivo.prom'])
+
+    def test_harvest_counts(self):
+        session = harvest.WoSSession
+        harvest.WoSSession = FakeSession
+        FakeSession.found = 250
+        metrics.reset()
+        try:
+            records = list(harvest.get_publications("OG=Test", weeks=1, workers=2))
+        finally:
+            harvest.WoSSession = session
+        summary = metrics.summary()
+        self.assertEqual(summary['records_parsed'], len(records))
+        self.assertTrue(summary['bytes_received'] > 0)
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from wos2vivo.names import NameCache
+
+
+class TestNameCache(TestCase):
+
+    def test_parse(self):
+        cache = NameCache()
+        self.assertEqual(cache.parse("Herman, M. P."), ("M.", "P.", "Herman"))
+        self.assertEqual(cache.parse("Khachatryan, V."), ("V.", "", "Khachatryan"))
+        self.assertEqual(cache.parse("Khachatryan, V."), ("V.", "", "Khachatryan"))
+        self.assertEqual(cache.stats(), dict(hits=1, misses=2, size=2, maxsize=100000))
+
+    def test_record_and_update(self):
+        worker = NameCache()
+        worker.parse("Herman, M. P.")
+        worker.record()
+        worker.parse("Herman, M. P.")
+        worker.parse("Khachatryan, V.")
+        self.assertEqual(worker.recorded(), [("Khachatryan, V.", ("V.", "", "Khachatryan"))])
+        worker.parse("Amdur, R. J.")
+        self.assertEqual(worker.recorded(), [])
+        cache = NameCache()
+        cache.update([("Khachatryan, V.", ["V.", "", "Khachatryan"])], hits=1, misses=1)
+        self.assertEqual(cache.parse("Khachatryan, V."), ("V.", "", "Khachatryan"))
+        self.assertEqual(cache.stats(), dict(hits=2, misses=1, size=1, maxsize=100000))
+
+    def test_least_recently_used_evicted(self):
+        cache = NameCache(maxsize=2)
+        cache.parse("Amdur, R. J.")
+        cache.parse("Herman, M. P.")
+        cache.parse("Amdur, R. J.")
+        cache.parse("Werning, J. W.")
+        self.assertEqual(len(cache), 2)
+        cache.parse("Amdur, R. J.")
+        self.assertEqual(cache.hits, 2)
+        cache.parse("Herman, M. P.")
+        self.assertEqual(cache.misses, 4)
+
+    def test_persist(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "names.json")
+            cache = NameCache()
+            cache.parse("Morris, C. G.")
+            cache.save(path)
+            cache = NameCache()
+            cache.load(path)
+            self.assertEqual(cache.parse("Morris, C. G."), ("C.", "G.", "Morris"))
+            self.assertEqual(cache.stats()['hits'], 1)
+        finally:
+            shutil.rmtree(tmp)
@@ -0,0 +1,110 @@
+import os
+import time
+from unittest import TestCase
+
+import xml.etree.ElementTree as ET
+
+from rdflib import Graph
+
+from wos2vivo.names import name_cache
+from wos2vivo.pipeline import map_records, prefetched, staged
+from wos2vivo.record import Record
+
+with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'record.xml')) as f:
+    RECORD = f.read()
+
+
+def records(num):
+    for n in range(num):
+        yield Record(ET.fromstring(RECORD.replace("WOS:000371581900197", "WOS:{:015d}".format(n))))
+
+
+class TestMapRecords(TestCase):
+
+    def test_map_records(self):
+        g = Graph()
+        total = 0
+        for nt, trips, recs in map_records(records(25), processes=2, chunksize=4):
+            g.parse(data=nt, format="nt")
+            total += recs
+        self.assertEqual(total, 25)
+        expected = Graph()
+        for rec in records(25):
+            for triple in rec.iter_triples():
+                expected.add(triple)
+        self.assertEqual(set(g), set(expected))
+
+    def test_names_returned(self):
+        # Names parsed in the workers end up in the cache of this process.
+        name_cache.clear()
+        list(map_records(records(8), processes=2, chunksize=4))
+        self.assertGreater(len(name_cache), 0)
+        # Each worker parses a name the first time it sees it.
+        self.assertGreaterEqual(name_cache.stats()['misses'], len(name_cache))
+        self.assertGreater(name_cache.stats()['hits'], 0)
+
+
+class TestStaged(TestCase):
+
+    def test_order_and_stats(self):
+        written = []
+        stages = staged(iter(range(500)), lambda n: n * 2, written.append, queue_size=10)
+        self.assertEqual(written, [n * 2 for n in range(500)])
+        self.assertEqual([stage.name for stage in stages], ["fetch", "map", "write"])
+        self.assertEqual([stage.items for stage in stages], [500, 500, 500])
+        for stage in stages:
+            self.assertTrue(0 <= stage.utilization() <= 1)
+
+    def test_backpressure(self):
+        fetched = []
+
+        def records():
+            for n in range(100):
+                fetched.append(n)
+                yield n
+
+        def writer(n):
+            # The fetch stage is at most two queues and the item
+            # each stage holds ahead of the writer.
+            self.assertTrue(len(fetched) - n <= 2 * 5 + 3)
+            time.sleep(0.001)
+
+        staged(records(), lambda n: n, writer, queue_size=5)
+        self.assertEqual(len(fetched), 100)
+
+    def test_errors_raised(self):
+        def records():
+            yield 1
+            raise ValueError("fetch failed")
+
+        with self.assertRaises(ValueError):
+            staged(records(), lambda n: n, lambda n: None)
+        with self.assertRaises(ZeroDivisionError):
+            staged(iter(range(1000)), lambda n: 1 / (n - 500), lambda n: None, queue_size=10)
+
+
+class TestPrefetched(TestCase):
+
+    def test_order_and_bound(self):
+        started = []
+
+        def source(n):
+            started.append(n)
+            for i in range(50):
+                yield n * 100 + i
+
+        items = prefetched((source(n) for n in range(6)), ahead=2, queue_size=5)
+        self.assertEqual(next(items), 0)
+        time.sleep(0.1)
+        # Only two sources are read at a time.
+        self.assertEqual(sorted(started), [0, 1])
+        rest = list(items)
+        self.assertEqual([0] + rest, [n * 100 + i for n in range(6) for i in range(50)])
+
+    def test_errors_raised(self):
+        def failing():
+            yield 1
+            raise ValueError("source failed")
+
+        with self.assertRaises(ValueError):
+            list(prefetched([iter([0]), failing(), iter([2])], ahead=3))
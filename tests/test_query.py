@@ -1,3 +1,4 @@
+from datetime import date
 from unittest import TestCase
 
 from wos2vivo.query import Query, Retrieve
@@ -50,6 +51,45 @@ class TestQuery(TestCase):
             tspan['end']
         )
 
+    def test_cache_key(self):
+        tspan = {"begin": "2015-09-01", "end": "2015-11-31"}
+        key = Query("OG=(University  of\nFlorida)", span=tspan, start=101).cache_key()
+        self.assertEqual(key, Query("OG=(University of Florida)", span=tspan).cache_key())
+        self.assertNotEqual(key, Query("OG=(University of Florida)", weeks=1).cache_key())
+        self.assertNotEqual(key, Query("OG=(University of Florida)", span=tspan, count=50).cache_key())
+
+    def test_cache_key_weeks(self):
+        q = Query("OG=(University of Florida)", weeks=1)
+        self.assertTrue(q.cache_key().startswith("databaseId=WOS|userQuery=OG=(University of Florida)|symbolicTimeSpan=1week@"))
+        # A weekly run on another day does not reuse the pages.
+        later = Query("OG=(University of Florida)", weeks=1)
+        later.run_date = date(2016, 3, 15)
+        self.assertNotEqual(q.cache_key(), later.cache_key())
+
+    def test_cache_key_utf8(self):
+        key = Query('OG=Universit\xc3\xa9 Laval', weeks=1).cache_key()
+        self.assertEqual(key, Query(u'OG=Universit\xe9 Laval', weeks=1).cache_key())
+
+    def test_params(self):
+        q = Query("peanut allergy", span={"begin": "2015-09-01", "end": "2015-11-31"})
+        self.assertEqual(q.query_params("peanut allergy").find("userQuery").text, "peanut allergy")
+        self.assertEqual(q.retrieve_params(101, 50).find("firstRecord").text, "101")
+        self.assertEqual(q.date(2, None).text, "2week")
+        self.assertEqual(q.date(None, {"begin": "2015-09-01", "end": "2015-11-31"}).find("end").text, "2015-11-31")
+        self.assertEqual(q.date(None, None), None)
+
+    def test_escaping(self):
+        uq = u"OG=(Universit\xe9 <Paris> & Co)"
+        message = Query(uq, weeks=2).to_string()
+        self.assertTrue(isinstance(message, str))
+        self.assertTrue("&lt;Paris&gt; &amp; Co" in message)
+        tree = ET.fromstring(message)
+        self.assertEqual(tree.find(".//userQuery").text, uq)
+        self.assertEqual(tree.find(".//queryLanguage").text, "en")
+
+    def test_pretty(self):
+        self.assertTrue("<userQuery>peanut allergy</userQuery>" in Query("peanut allergy").pretty())
+
 
 class TestRetrieve(TestCase):
 
@@ -67,4 +107,4 @@ class TestRetrieve(TestCase):
         self.assertEqual(
             tree.find(".//count").text,
             "100"
-        )
\ No newline at end of file
+        )
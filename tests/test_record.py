@@ -0,0 +1,102 @@
+import os
+import pickle
+from unittest import TestCase
+
+import xml.etree.ElementTree as ET
+
+from rdflib import URIRef
+
+from wos2vivo.record import Record, Dimensions, D, VIVO, terms
+
+with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'record.xml')) as f:
+    RECORD = f.read()
+
+
+class TestRecord(TestCase):
+
+    def setUp(self):
+        self.rec = Record(ET.fromstring(RECORD))
+
+    def test_source_fields(self):
+        self.assertEqual(self.rec.venue(), "INTERNATIONAL JOURNAL OF RADIATION ONCOLOGY BIOLOGY PHYSICS")
+        self.assertEqual(self.rec.volume(), "94")
+        self.assertEqual(self.rec.issue(), "4")
+        self.assertEqual(self.rec.pages(), "932-932")
+        self.assertEqual(self.rec.date(), ("MAR", "2016"))
+
+    def test_identifiers(self):
+        self.assertEqual(self.rec.issn(), "0360-3016")
+        self.assertEqual(self.rec.eissn(), "1879-355X")
+        self.assertEqual(self.rec.isbn(), None)
+        self.assertEqual(self.rec.doi(), "10.1016/j.ijrobp.2015.12.247")
+
+    def test_first_value_wins(self):
+        root = ET.fromstring(RECORD)
+        extra = ET.SubElement(root, 'source')
+        ET.SubElement(extra, 'label').text = 'Volume'
+        ET.SubElement(extra, 'value').text = '95'
+        self.assertEqual(Record(root).volume(), "94")
+
+    def test_uris(self):
+        self.assertEqual(self.rec.ut(), "WOS:000371581900197")
+        self.assertEqual(self.rec.localid, "WOS-000371581900197")
+        self.assertEqual(self.rec.pub_uri, D['pub-WOS-000371581900197'])
+
+    def test_iter_triples(self):
+        triples = list(self.rec.iter_triples())
+        self.assertEqual(len(triples), len(set(triples)))
+        self.assertEqual(set(triples), set(self.rec.to_rdf()))
+        # The section graphs are subsets of the whole.
+        for g in [self.rec.add_venue(), self.rec.add_date(), self.rec.authorship()]:
+            self.assertTrue(set(g) <= set(triples))
+
+    def test_pub_date(self):
+        self.assertEqual(self.rec.pub_date(), ("2016", "MAR", 3))
+        root = ET.fromstring(RECORD.replace("MAR 15", "WIN"))
+        self.assertEqual(Record(root).pub_date(), ("2016", "WIN", None))
+        root = ET.fromstring(RECORD.replace("MAR 15", "Dec"))
+        self.assertEqual(Record(root).pub_date()[2], 12)
+
+    def test_venue_emitted_once(self):
+        dimensions = Dimensions()
+        other = Record(ET.fromstring(RECORD.replace("WOS:000371581900197", "WOS:000371581900198")))
+        first = set(self.rec.iter_triples(dimensions))
+        second = set(other.iter_triples(dimensions))
+        venue = D['venue-0360-3016']
+        self.assertEqual(len([t for t in first if t[0] == venue]), 3)
+        self.assertEqual([t for t in second if t[0] == venue], [])
+        # The publication still links to the venue.
+        self.assertTrue((other.pub_uri, VIVO.hasPublicationVenue, venue) in second)
+
+    def test_filter_ntriples(self):
+        dimensions = Dimensions()
+        nt, count = dimensions.filter_ntriples(self.rec.to_nt())
+        self.assertEqual(count, len(self.rec.to_rdf()))
+        other = Record(ET.fromstring(RECORD.replace("WOS:000371581900197", "WOS:000371581900198")))
+        nt, count = dimensions.filter_ntriples(other.to_nt())
+        self.assertEqual(count, len(other.to_rdf()) - 3)
+        self.assertFalse(any(line.startswith(Dimensions.VENUE_PREFIX) for line in nt.splitlines()))
+
+    def test_compact(self):
+        # Only the extracted fields are kept.
+        self.assertFalse(hasattr(self.rec, '__dict__'))
+        self.assertEqual(self.rec.authors()[0], "Herman, M. P.")
+        self.assertEqual(len(self.rec.authors()), 6)
+        self.assertEqual(set(Record(self.rec.root).to_rdf()), set(self.rec.to_rdf()))
+
+    def test_pickle(self):
+        copy = pickle.loads(pickle.dumps(self.rec, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copy.ut(), self.rec.ut())
+        self.assertEqual(set(copy.to_rdf()), set(self.rec.to_rdf()))
+
+    def test_terms(self):
+        self.assertEqual(terms.uri('vcard-name', '1', 'WOS-1'), D['vcard-name-1-WOS-1'])
+        self.assertTrue(isinstance(terms.uri('pub', 'WOS-1'), URIRef))
+        self.assertEqual(terms.uri('venue', 'a b'), URIRef(D + 'venue-a b'))
+        # Terms repeated across records are shared.
+        other = Record(ET.fromstring(RECORD.replace("WOS:000371581900197", "WOS:000371581900198")))
+        first = dict(((p, o), o) for s, p, o in self.rec.iter_triples() if p == VIVO.rank)
+        second = dict(((p, o), o) for s, p, o in other.iter_triples() if p == VIVO.rank)
+        self.assertEqual(len(first), 6)
+        for key, rank in first.items():
+            self.assertTrue(second[key] is rank)
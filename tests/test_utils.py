@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import xml.etree.ElementTree as ET
+
+from rdflib import Graph
+from rdflib.compare import isomorphic
+
+from wos2vivo.record import Record
+from wos2vivo.utils import StreamWriter
+
+# A single record element from the query cassette.
+with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'record.xml')) as f:
+    RECORD = f.read()
+
+
+class TestStreamWriter(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.rec = Record(ET.fromstring(RECORD))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, format):
+        path = os.path.join(self.tmp, "out." + format)
+        with StreamWriter(path, format=format) as writer:
+            # Same record twice, duplicate triples are harmless.
+            writer.write(self.rec.to_rdf())
+            writer.write(self.rec.to_rdf())
+        g = Graph()
+        g.parse(path, format=format)
+        return writer, g
+
+    def test_nt(self):
+        writer, g = self.write("nt")
+        expected = self.rec.to_rdf()
+        self.assertEqual(writer.triples, len(expected) * 2)
+        self.assertTrue(isomorphic(g, expected))
+
+    def test_turtle(self):
+        writer, g = self.write("turtle")
+        self.assertTrue(isomorphic(g, self.rec.to_rdf()))
@@ -1,6 +1,8 @@
 
 import base64
+import json
 import os
+from io import BytesIO
 from unittest import TestCase
 
 import betamax
@@ -22,7 +24,7 @@ with betamax.Betamax.configure() as config:
     config.cassette_library_dir = os.path.join(TEST_PATH, 'fixtures')
 
 
-from wos2vivo.client import WoSSession, QueryResponse
+from wos2vivo.client import WoSSession, QueryResponse, StreamingQueryResponse
 from wos2vivo.query import Query
 from wos2vivo.record import BIBO, OBO, VIVO, VCARD
 
@@ -105,3 +107,32 @@ class TestWos(TestCase):
                 )
 
             session.close()
+
+
+class TestStreamingQueryResponse(TestCase):
+
+    def response_body(self):
+        with open(os.path.join(TEST_PATH, 'fixtures', 'query.json')) as f:
+            cassette = json.load(f)
+        body = cassette['http_interactions'][1]['response']['body']
+        return body['string'].encode(body['encoding'])
+
+    def test_stream(self):
+        qrsp = StreamingQueryResponse(BytesIO(self.response_body()))
+        self.assertEqual(qrsp.query_id, "1")
+        self.assertEqual(qrsp.found, 33)
+        records = list(qrsp.records)
+        self.assertEqual(qrsp.number, 1)
+        self.assertTrue(qrsp.has_more())
+        rec = records[0]
+        self.assertEqual(rec.ut(), "WOS:000371581900197")
+        self.assertEqual(rec.doi(), "10.1016/j.ijrobp.2015.12.247")
+        self.assertEqual(len(rec.authors()), 6)
+        # Parsed records are not kept in the document.
+        self.assertEqual(qrsp._return.findall('records'), [])
+
+    def test_fault(self):
+        fault = '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body><soap:Fault><faultcode>soap:Server</faultcode><faultstring>Bad query</faultstring></soap:Fault></soap:Body></soap:Envelope>'
+        with self.assertRaises(Exception) as ctx:
+            StreamingQueryResponse(BytesIO(fault))
+        self.assertEqual(str(ctx.exception), "Bad query")
@@ -0,0 +1,120 @@
+"""
+On-disk cache of WoS responses.
+"""
+
+import hashlib
+import os
+import time
+import zlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+from metrics import metrics
+
+
+class ResponseCache(object):
+    """
+    Compressed response bodies stored in a directory, one file per key.
+
+    Entries older than `ttl` seconds are not used. When the directory
+    grows past `max_bytes`, the least recently used entries are
+    removed. The size of the directory is counted once, on the first
+    write, and kept up to date as entries are written and removed.
+    """
+
+    def __init__(self, directory, ttl=None, max_bytes=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Bytes in the directory, None until counted.
+        self._size = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.directory, hashlib.sha1(key).hexdigest() + '.z')
+
+    def get(self, key):
+        """
+        :param key: str
+        :return: str response body or None
+        """
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                os.remove(path)
+                if self._size is not None:
+                    self._size -= stat.st_size
+                raise OSError("Expired cache entry.")
+            with open(path, 'rb') as f:
+                body = zlib.decompress(f.read())
+        except (OSError, IOError, zlib.error):
+            self.misses += 1
+            return None
+        # The access time orders entries for eviction, the
+        # modification time is the age of the entry.
+        os.utime(path, (time.time(), stat.st_mtime))
+        self.hits += 1
+        metrics.incr('cache_hits')
+        return body
+
+    def set(self, key, body):
+        """
+        :param key: str
+        :param body: str response body
+        """
+        path = self._path(key)
+        data = zlib.compress(body)
+        replaced = 0
+        if self._size is not None:
+            try:
+                replaced = os.stat(path).st_size
+            except OSError:
+                pass
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+        if self.max_bytes is None:
+            return
+        if self._size is None:
+            self.evict()
+        else:
+            self._size += len(data) - replaced
+            if self._size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in
+        max_bytes. Counts the size of the directory again, so entries
+        written by other processes are included.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.z'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        while total > self.max_bytes and entries:
+            atime, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            logger.debug("Evicted {} from response cache.".format(path))
+        self._size = total
@@ -0,0 +1,151 @@
+"""
+Persist harvest progress so an interrupted harvest can resume.
+"""
+
+import json
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint(object):
+    """
+    Harvest state saved to a JSON file after every completed page:
+    the query, the time period and the firstRecord offset of the last
+    completed page. The UTs already emitted are appended to a file
+    next to it, path + '.uts', one per line.
+
+    A harvest of the same query and period picks up after the last
+    completed page. Once a harvest completes, later runs of the same
+    query start from the first page again but skip the UTs that were
+    already emitted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.uts_path = path + '.uts'
+        # Called before saving, to flush the output the emitted UTs
+        # were written to.
+        self.sync = None
+        self.reset()
+        if os.path.exists(path):
+            self.load()
+
+    def reset(self, query=None, weeks=None, span=None):
+        self.query = query
+        self.weeks = weeks
+        self.span = span
+        # firstRecord offset of the last completed page. 0 when no page is done.
+        self.offset = 0
+        self.complete = False
+        self.uts = set()
+        # UTs not in the UTs file yet, and whether the file starts over.
+        self._unsaved = []
+        self._rewrite = True
+
+    def load(self):
+        with open(self.path) as f:
+            state = json.load(f)
+        self.query = state['query']
+        self.weeks = state['weeks']
+        self.span = state['span']
+        self.offset = state['offset']
+        self.complete = state['complete']
+        self.uts = set()
+        if os.path.exists(self.uts_path):
+            with open(self.uts_path) as f:
+                self.uts.update(line.strip() for line in f if line.strip())
+        self._unsaved = []
+        # Checkpoints saved before the UTs file had them in the state.
+        self._rewrite = 'uts' in state
+        self.uts.update(state.get('uts', []))
+
+    def _save_uts(self):
+        if self._rewrite:
+            tmp = self.uts_path + '.tmp'
+            with open(tmp, 'w') as f:
+                for ut in sorted(self.uts):
+                    f.write(ut + "\n")
+            os.rename(tmp, self.uts_path)
+            self._rewrite = False
+        elif self._unsaved:
+            # Only the new UTs are written, so saving does not get
+            # slower as a harvest goes on.
+            with open(self.uts_path, 'a') as f:
+                f.write("".join(ut + "\n" for ut in self._unsaved))
+        self._unsaved = []
+
+    def save(self):
+        if self.sync is not None:
+            self.sync()
+        self._save_uts()
+        state = dict(
+            query=self.query,
+            weeks=self.weeks,
+            span=self.span,
+            offset=self.offset,
+            complete=self.complete
+        )
+        # Write to a temp file first so a crash never leaves a partial checkpoint.
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.rename(tmp, self.path)
+
+    def matches(self, query, weeks=None, span=None):
+        return (self.query, self.weeks, self.span) == (query, weeks, span)
+
+    def resumes(self, query, weeks=None, span=None):
+        """
+        Determine if a harvest of these parameters would continue
+        an unfinished one.
+        :return: boolean
+        """
+        return self.matches(query, weeks, span) and not self.complete and self.offset > 0
+
+    def appends(self, query, weeks=None, span=None):
+        """
+        Determine if a harvest of these parameters adds to the output
+        of an earlier one, interrupted or complete, rather than
+        starting it over.
+        :return: boolean
+        """
+        return self.resumes(query, weeks, span) or (self.matches(query, weeks, span) and len(self.uts) > 0)
+
+    def begin(self, query, weeks=None, span=None):
+        """
+        Start or resume a harvest.
+
+        :return: int offset of the last completed page
+        """
+        if not self.matches(query, weeks, span):
+            self.reset(query, weeks, span)
+        elif self.complete:
+            # Keep the emitted UTs so they are skipped.
+            self.offset = 0
+            self.complete = False
+        else:
+            logger.info("Resuming harvest of {} after record {}.".format(query, self.offset))
+        return self.offset
+
+    def seen(self, ut):
+        return ut in self.uts
+
+    def page_done(self, offset, uts):
+        """
+        Record a completed page.
+
+        :param offset: int firstRecord of the page
+        :param uts: list of UTs emitted from the page
+        """
+        self.offset = offset
+        for ut in uts:
+            if ut not in self.uts:
+                self.uts.add(ut)
+                self._unsaved.append(ut)
+        self.save()
+
+    def finish(self):
+        self.complete = True
+        self.save()
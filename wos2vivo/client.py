@@ -4,32 +4,120 @@ Login and query WoS Web Services Expanded
 
 import base64
 import os
+import random
+import time
 import xml.etree.ElementTree as ET
+from threading import Lock
 
 import logging
 logger = logging.getLogger(__name__)
 
 from requests import Session
+from requests.exceptions import ConnectionError, Timeout
 
 import constants
-from record import Record
+from metrics import metrics
+
+
+class SessionExpired(Exception):
+    """
+    The WoS session id expired. The session has been authenticated
+    again, but query ids from the old session are no longer valid.
+    """
+
+
+class RateLimiter(object):
+    """
+    Space out requests to at most per_second requests a second,
+    across threads.
+    """
+
+    def __init__(self, per_second=None):
+        self.interval = 1.0 / per_second if per_second else 0
+        self._next = 0
+        self._lock = Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
 
 
 class WoSSession(Session):
 
-    def __init__(self, login=True):
+    def __init__(
+            self,
+            login=True,
+            retries=constants.RETRIES,
+            backoff=constants.BACKOFF,
+            per_second=constants.REQUESTS_PER_SECOND,
+            session_limit=constants.SESSION_QUERY_LIMIT,
+            timeout=constants.TIMEOUT,
+            cache=None
+    ):
         """
         Pass login=False to not authenticate when the session
         is created. This is only used in testing.
 
+        Transient failures (connection errors, timeouts, 502-504 and
+        throttling faults) are retried up to `retries` times with
+        exponential backoff and jitter. Requests are limited to
+        `per_second` a second and the session is renewed after
+        `session_limit` queries. An expired session is authenticated
+        again. Query messages are then sent once more. Retrieve
+        messages raise SessionExpired, as their query id belonged to
+        the old session.
+
+        With a cache.ResponseCache the session only authenticates
+        when the first request has to go to the service, so a harvest
+        answered entirely from the cache runs offline.
+
         :param login: boolean
+        :param retries: int
+        :param backoff: float seconds before the first retry
+        :param per_second: float
+        :param session_limit: int queries per session, None for no limit
+        :param timeout: float seconds
+        :param cache: cache.ResponseCache
         :return: WoSSession
         """
         super(WoSSession, self).__init__()
         self.login = login
+        self.retries = retries
+        self.backoff = backoff
+        self.session_limit = session_limit
+        self.timeout = timeout
+        self.limiter = RateLimiter(per_second)
+        self.cache = cache
+        # Number of requests that were retried.
+        self.retried = 0
+        self._queries = 0
+        # Incremented every time the session authenticates.
+        self._generation = 0
+        self._auth_lock = Lock()
+
+    @property
+    def generation(self):
+        """
+        Number of times the session authenticated. Query ids from
+        an earlier generation are no longer valid.
+        """
+        return self._generation
+
+    def _deferred(self):
+        """
+        Determine if authentication was deferred until the first
+        request the cache cannot answer, and has not happened yet.
+        """
+        return self.login is True and self.cache is not None and self._generation == 0
 
     def __enter__(self):
-        if self.login is True:
+        if self.login is True and self.cache is None:
             self.authenticate()
         return self
 
@@ -40,24 +128,154 @@ class WoSSession(Session):
     def wauth_header():
         return {"Authorization": "Basic %s" % base64.b64encode("%s:%s" % (os.environ['WOS_USER'], os.environ['WOS_PASSWORD']))}
 
+    @staticmethod
+    def _fault(rsp, faults):
+        """
+        Determine if a SOAP fault response matches any of faults.
+        """
+        if rsp.status_code != 500:
+            return False
+        return any(fault in rsp.content for fault in faults)
+
+    def _sleep(self, attempt):
+        delay = self.backoff * (2 ** attempt)
+        time.sleep(delay + random.uniform(0, delay))
+
+    def _send(self, url, data, headers=None, stream=False):
+        """
+        Post a message, retrying transient failures.
+
+        :return: requests.Response
+        """
+        attempt = 0
+        while True:
+            self.limiter.wait()
+            try:
+                rsp = self.post(url, data=data, headers=headers, stream=stream, timeout=self.timeout)
+            except (ConnectionError, Timeout) as e:
+                if attempt >= self.retries:
+                    raise
+                logger.warning("WoS request failed: {}. Retrying.".format(e))
+            else:
+                if rsp.status_code in constants.RETRY_STATUS:
+                    reason = "status {}".format(rsp.status_code)
+                elif self._fault(rsp, constants.THROTTLE_FAULTS):
+                    reason = "throttled"
+                else:
+                    return rsp
+                if attempt >= self.retries:
+                    return rsp
+                logger.warning("WoS request {}. Retrying.".format(reason))
+                rsp.close()
+            self.retried += 1
+            metrics.incr('retries')
+            self._sleep(attempt)
+            attempt += 1
+
     def authenticate(self):
         logger.debug("Authenticating with WoS.")
-        rsp = self.post(
+        rsp = self._send(
             constants.AUTH_URL,
             data=constants.AUTHENTICATE,
             headers=self.wauth_header()
         )
         if rsp.status_code == 500:
             raise Exception("WoS returned 500 error:\n" + rsp.text)
+        self._generation += 1
+        self._queries = 0
         return rsp.status_code
 
-    def query(self, query_doc):
-        rsp = self.post(constants.SEARCH_URL, data=query_doc)
+    def _renew(self, generation):
+        """
+        Authenticate again unless another thread already did since
+        `generation`.
+        """
+        with self._auth_lock:
+            if self._generation == generation:
+                self.authenticate()
+
+    def _search(self, query_doc, stream=False):
+        """
+        Send a Query or Retrieve message. A Query message is sent once
+        more if the session expired.
+
+        :return: requests.Response
+        :raises: SessionExpired for Retrieve messages
+        """
+        # Only Retrieve messages carry a query id.
+        retrieve = '<queryId>' in query_doc
+        try:
+            return self._search_once(query_doc, retrieve, stream)
+        except SessionExpired:
+            if retrieve:
+                raise
+        return self._search_once(query_doc, retrieve, stream)
+
+    def _search_once(self, query_doc, retrieve, stream):
+        if self._deferred():
+            # Authenticate a cached session on its first live request.
+            self._renew(0)
+        generation = self._generation
+        if self.login and self.session_limit and self._queries >= self.session_limit:
+            logger.info("Session query limit reached. Starting a new WoS session.")
+            self._renew(generation)
+            if retrieve:
+                raise SessionExpired("Session query limit reached.")
+        self._queries += 1
+        with metrics.timer('retrieve_seconds' if retrieve else 'query_seconds'):
+            rsp = self._send(constants.SEARCH_URL, data=query_doc, stream=stream)
+        metrics.incr('requests')
         logger.debug("WOS query:\n {}".format(query_doc))
         logger.debug("Query status code: {}".format(rsp.status_code))
+        if self.login and self._fault(rsp, constants.SESSION_FAULTS):
+            logger.info("WoS session expired. Authenticating again.")
+            self._renew(generation)
+            raise SessionExpired(rsp.text)
+        return rsp
+
+    def query(self, query_doc):
+        """
+        :param query_doc: str
+        :return: str response text
+        :raises: SessionExpired for Retrieve messages
+        """
+        rsp = self._search(query_doc)
+        metrics.incr('bytes_received', len(rsp.content))
         return rsp.text
 
+    def query_content(self, query_doc):
+        """
+        :param query_doc: str
+        :return: str response body
+        :raises: SessionExpired for Retrieve messages
+        """
+        rsp = self._search(query_doc)
+        if rsp.status_code != 200:
+            raise Exception(rsp.text)
+        metrics.incr('bytes_received', len(rsp.content))
+        return rsp.content
+
+    def query_stream(self, query_doc):
+        """
+        Send a query without reading the response body. Read the
+        body from the returned response's raw stream, e.g. with
+        StreamingQueryResponse, and close the response when done.
+
+        :param query_doc: str
+        :return: requests.Response
+        :raises: SessionExpired for Retrieve messages
+        """
+        rsp = self._search(query_doc, stream=True)
+        if rsp.status_code != 200:
+            raise Exception(rsp.text)
+        # Undo any gzip transfer encoding while reading.
+        rsp.raw.decode_content = True
+        return rsp
+
     def close(self):
+        if self._deferred():
+            # Never authenticated, nothing to close.
+            return
         rsp = self.post(constants.AUTH_URL, data=constants.CLOSE)
         logger.debug("Closing session. Status code: {}.".format(rsp.status_code))
         if rsp.status_code != 200:
@@ -76,8 +294,69 @@ class QueryResponse(object):
         except AttributeError:
             raise Exception(response_text)
         self.found = int(qrsp.find('recordsFound').text)
+        # Imported with the first response, so importing the client
+        # does not load rdflib.
+        from record import Record
         self.records = [Record(r) for r in qrsp.findall('records')]
         self.number = len(self.records)
+        metrics.incr('records_parsed', self.number)
+
+    def has_more(self):
+        """
+        Determine if query has more records to fetch.
+        :return: boolean
+        """
+        return self.found > self.number
+
+
+class StreamingQueryResponse(object):
+    """
+    Read a query or retrieve response incrementally from a byte stream.
+
+    The queryId and recordsFound precede the records in the response,
+    so they are available once the object is created. The records are
+    parsed one at a time as they are iterated, and each parsed records
+    element is detached from the document so only the records the
+    caller still holds are kept in memory.
+    """
+
+    def __init__(self, stream):
+        self._events = ET.iterparse(stream, events=('start', 'end'))
+        self.query_id = None
+        self.found = None
+        # Number of records read so far.
+        self.number = 0
+        self._return = None
+        fault = None
+        for event, elem in self._events:
+            if event == 'start':
+                if elem.tag == 'return':
+                    self._return = elem
+                elif elem.tag == 'records':
+                    break
+            elif elem.tag == 'queryId':
+                self.query_id = elem.text
+            elif elem.tag == 'recordsFound':
+                self.found = int(elem.text)
+            elif elem.tag == 'faultstring':
+                fault = elem.text
+        # If we can't find a queryId then the query failed.
+        if self.query_id is None or self.found is None:
+            raise Exception(fault or "No queryId found in WoS response.")
+
+    @property
+    def records(self):
+        """
+        The records of the response. Can only be iterated once.
+        :return: generator of record.Record
+        """
+        from record import Record
+        for event, elem in self._events:
+            if event == 'end' and elem.tag == 'records':
+                self._return.remove(elem)
+                self.number += 1
+                metrics.incr('records_parsed')
+                yield Record(elem)
 
     def has_more(self):
         """
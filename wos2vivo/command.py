@@ -7,17 +7,38 @@ $ wos2vivo "University of Idaho"
 
 """
 
+import csv
+import os
+import time
+from contextlib import contextmanager
+from functools import partial
+
 import click
-from rdflib import Graph
 
-from wos2vivo.harvest import get_publications_for_org
-from wos2vivo.utils import output_graph
+# rdflib, the mapping, the Web of Science client and the triple store
+# loader are imported by the functions that use them, so --help and
+# option errors do not wait for them. See benchmarks/startup.py.
+from wos2vivo import names
+from wos2vivo.cache import ResponseCache
+from wos2vivo.checkpoint import Checkpoint
+from wos2vivo.constants import PROTOCOLS, QUERY_LENGTH, STREAM_FORMATS
+from wos2vivo.delta import Delta, DeltaStore
+from wos2vivo.metrics import metrics
+from wos2vivo.pipeline import map_records, staged
 
 
 def console(msg):
     click.echo(msg, err=True)
 
 
+def check_environment():
+    """
+    Fail before querying if the mapping can not be configured.
+    """
+    if not os.environ.get('DATA_NAMESPACE'):
+        raise click.UsageError("Set the DATA_NAMESPACE environment variable to the namespace of your VIVO instance.")
+
+
 def valid_span(begin, end):
     if (begin is None) and (end is None):
         return None
@@ -27,15 +48,150 @@ def valid_span(begin, end):
     return dict(begin=begin, end=end)
 
 
-def get_triples(org, out_file, weeks=1, span=None, format="turtle"):
-    g = Graph()
+@contextmanager
+def persistent_names(path=None):
+    """
+    Load parsed author names from path before mapping and save them
+    afterwards. Reports cache statistics either way.
+    """
+    if path is not None:
+        names.name_cache.load(path)
+    yield names.name_cache
+    if path is not None:
+        names.name_cache.save(path)
+    stats = names.name_cache.stats()
+    console("Author names: {hits} cache hits, {misses} parsed, {size} cached.".format(**stats))
+
+
+def response_cache(directory, ttl=None, size=None):
+    """
+    :param directory: str cache directory or None for no cache
+    :param ttl: float hours
+    :param size: float megabytes
+    :return: cache.ResponseCache
+    """
+    if directory is None:
+        return None
+    return ResponseCache(
+        directory,
+        ttl=ttl * 3600 if ttl is not None else None,
+        max_bytes=int(size * 1024 * 1024) if size is not None else None
+    )
+
+
+def map_record(rec, dimensions=None):
+    """
+    :param rec: record.Record
+    :param dimensions: record.Dimensions
+    :return: rdflib.Graph
+    """
+    start = time.time()
+    g = rec.to_rdf(dimensions)
+    metrics.observe('map_seconds', time.time() - start)
+    metrics.incr('records_mapped')
+    return g
+
+
+def report_metrics(path=None):
+    """
+    Print the harvest metrics and save them to path if given.
+    """
+    for line in metrics.report():
+        console(line)
+    if path is not None:
+        metrics.save(path)
+
+
+def get_records(org, weeks=1, span=None, workers=1, checkpoint=None, cache=None, split=False, parallel=1):
+    from wos2vivo.harvest import get_publications_for_org, get_publications_for_orgs
+    if split:
+        return get_publications_for_orgs([dict(name=org, span=span)], workers=workers, parallel=parallel, cache=cache, split=True)
     if span is not None:
-        records = get_publications_for_org(org, span=span)
+        return get_publications_for_org(org, span=span, workers=workers, checkpoint=checkpoint, cache=cache)
     else:
-        records = get_publications_for_org(org, weeks=int(weeks))
+        return get_publications_for_org(org, weeks=int(weeks), workers=workers, checkpoint=checkpoint, cache=cache)
+
+
+def report_stages(stages):
+    """
+    :param stages: list of pipeline.Stage
+    """
+    console("Stages: {}.".format(", ".join(str(stage) for stage in stages)))
+
+
+def write_mapped(records, writer, processes=None, overlap=True):
+    """
+    Write each record's triples to a utils.StreamWriter or
+    loader.SparqlLoader as soon as it is mapped. Pass processes to
+    map records in a pool of worker processes. Otherwise records are
+    fetched, mapped and written in overlapping stages, unless overlap
+    is False. Venues are written once, with the first record
+    published in them.
+
+    :return: int number of records
+    """
+    from wos2vivo.record import Dimensions
     num = 0
-    for num, rec in enumerate(records):
-        g += rec.to_rdf()
+    dimensions = Dimensions()
+    with writer:
+        if processes:
+            for nt, trips, recs in map_records(records, processes=processes, dimensions=dimensions):
+                writer.write_ntriples(nt, trips)
+                num += recs
+        elif overlap:
+            stages = staged(records, partial(map_record, dimensions=dimensions), writer.write)
+            report_stages(stages)
+            num = stages[-1].items
+        else:
+            for num, rec in enumerate(records, 1):
+                writer.write(map_record(rec, dimensions))
+    return num
+
+
+def write_stream(records, out_file, format="nt", append=False, processes=None, overlap=True, checkpoint=None):
+    """
+    Write each record's triples as soon as it is mapped. A checkpoint
+    flushes the file before it saves the records as written.
+    """
+    from wos2vivo.utils import StreamWriter
+    writer = StreamWriter(out_file, format=format, append=append)
+    if checkpoint is not None:
+        checkpoint.sync = writer.flush
+    num = write_mapped(records, writer, processes=processes, overlap=overlap)
+    console("{} records found. {} triples created.".format(num or 0, writer.triples))
+
+
+def write_endpoint(records, loader, processes=None, overlap=True):
+    """
+    Load each record's triples into a triple store as soon as it is
+    mapped.
+
+    :param loader: loader.SparqlLoader
+    """
+    num = write_mapped(records, loader, processes=processes, overlap=overlap)
+    console("{} records found. {} triples loaded in {} batches.".format(num or 0, loader.triples, loader.batches))
+
+
+def write_graph(records, out_file, format="turtle", processes=None):
+    """
+    Collect all triples in one graph and write it at the end. Pass
+    processes to map records in a pool of worker processes.
+    """
+    from rdflib import Graph
+    from wos2vivo.record import Dimensions
+    from wos2vivo.utils import output_graph
+    g = Graph()
+    num = 0
+    dimensions = Dimensions()
+    if processes:
+        for nt, trips, recs in map_records(records, processes=processes, dimensions=dimensions):
+            if trips:
+                g.parse(data=nt, format="nt")
+            num += recs
+    else:
+        stages = staged(records, partial(map_record, dimensions=dimensions), g.__iadd__)
+        report_stages(stages)
+        num = stages[-1].items
 
     trips = len(g)
     console("{} records found. {} triples created.".format(num or 0, trips))
@@ -46,15 +202,134 @@ def get_triples(org, out_file, weeks=1, span=None, format="turtle"):
             print output_graph(g, format=format)
 
 
+def write_delta(records, out_file, store_path, retractions_file):
+    """
+    Write the triples of new and changed records to out_file and the
+    triples that no longer apply to retractions_file, as N-Triples.
+    """
+    store = DeltaStore(store_path)
+    try:
+        with open(out_file, 'wb') as additions, open(retractions_file, 'wb') as retractions:
+            delta = Delta(store, additions, retractions)
+            for rec in records:
+                delta.write(rec)
+    finally:
+        store.close()
+    console("{} new, {} changed and {} unchanged records.".format(delta.new, delta.changed, delta.unchanged))
+    console("{} triples to add, {} to retract.".format(delta.added, delta.retracted))
+
+
+def write_records(records, out_file, format="turtle", stream=False, append=False, processes=None,
+                  delta_store=None, retractions=None, loader=None, checkpoint=None):
+    """
+    Write records with the output the command options asked for.
+    """
+    # Records a checkpoint counts as done must have been written,
+    # so they are not read ahead of the writer.
+    overlap = checkpoint is None
+    if loader is not None:
+        write_endpoint(records, loader, processes=processes, overlap=overlap)
+    elif delta_store is not None:
+        write_delta(records, out_file, delta_store, retractions)
+    elif stream:
+        write_stream(records, out_file, format=format, append=append, processes=processes, overlap=overlap,
+                     checkpoint=checkpoint)
+    else:
+        write_graph(records, out_file, format=format, processes=processes)
+
+
+def sparql_loader(endpoint, protocol="update", graph=None, batch_size=10000, workers=2):
+    """
+    :param endpoint: str URL or None for no loading
+    :return: loader.SparqlLoader
+    """
+    if endpoint is None:
+        return None
+    from wos2vivo.loader import SparqlLoader
+    return SparqlLoader(
+        endpoint,
+        protocol=protocol,
+        graph=graph,
+        batch_size=batch_size,
+        workers=workers,
+        email=os.environ.get('VIVO_EMAIL'),
+        password=os.environ.get('VIVO_PASSWORD')
+    )
+
+
+def check_output(out_file, format, stream, processes, delta_store, retractions, endpoint=None):
+    """
+    Validate the combination of output options.
+    """
+    if endpoint is not None and (out_file is not None or delta_store is not None):
+        raise click.BadParameter("--endpoint loads triples instead of writing them. Remove --file and --delta-store.")
+    if stream and format not in STREAM_FORMATS:
+        raise click.BadParameter("Streaming output supports {} formats.".format(", ".join(STREAM_FORMATS)))
+    if (delta_store is None) != (retractions is None):
+        raise click.BadParameter("--delta-store and --retractions must be used together.")
+    if delta_store is not None:
+        if out_file is None:
+            raise click.BadParameter("--delta-store requires --file for the triples to add.")
+        if format != "nt":
+            raise click.BadParameter("Delta output is written as N-Triples. Use --format=nt.")
+        if processes:
+            raise click.BadParameter("--delta-store maps records in one process. Remove --processes.")
+
+
+# Output, mapping, cache and loading options shared by the commands.
+SHARED_OPTIONS = [
+    click.option('--file', default=None, help="File to save triples to."),
+    click.option('--format', default="turtle", type=click.Choice(["nt", "turtle", "n3"]), help="RDFLib serialization format"),
+    click.option('--stream', is_flag=True, help="Write triples as each record is mapped. Supports nt and turtle."),
+    click.option('--name-cache', default=None, help="File to keep parsed author names in between runs."),
+    click.option('--processes', default=None, type=click.IntRange(1, None), help="Number of processes to map records to RDF with."),
+    click.option('--cache-dir', default=None, help="Directory to cache Web of Science responses in."),
+    click.option('--cache-ttl', default=None, type=float, help="Hours cached responses are used for. Default no limit."),
+    click.option('--cache-size', default=None, type=float, help="Maximum size of the response cache in megabytes. Default no limit."),
+    click.option('--delta-store', default=None, help="File of records exported by earlier runs. Only new and changed triples are written to --file."),
+    click.option('--retractions', default=None, help="File to save triples of changed records that no longer apply to. Requires --delta-store."),
+    click.option('--endpoint', default=None, help="SPARQL Update or Graph Store endpoint to load triples into as records are mapped."),
+    click.option('--protocol', default="update", type=click.Choice(PROTOCOLS), help="Protocol of --endpoint."),
+    click.option('--graph', default=None, help="Named graph to load triples into. Default graph if not set."),
+    click.option('--load-batch', default=10000, type=click.IntRange(1, None), help="Number of triples loaded per request."),
+    click.option('--load-workers', default=2, type=click.IntRange(1, None), help="Number of batches loaded concurrently."),
+    click.option('--metrics', 'metrics_file', default=None, help="File to save harvest metrics to. Prometheus text format if it ends in .prom, JSON otherwise."),
+]
+
+
+def shared_options(command):
+    """
+    Add SHARED_OPTIONS to a command, after its own options.
+    """
+    for option in reversed(SHARED_OPTIONS):
+        command = option(command)
+    return command
+
+
 @click.command(help="Pass in the organization enhanced name from the Web of Science")
 @click.argument('organization')
 @click.option('--weeks', default="1", type=click.Choice(["1", "2", "4"]), help='Number of previous weeks to search Web of Science.')
 @click.option('--begin', default=None, help="Start date for time span search, e.g. 2016-03-15")
 @click.option('--end', default=None, help="End date for time span search, e.g. 2016-03-17")
-@click.option('--file', default=None, help="File to save triples to.")
-@click.option('--format', default="turtle", type=click.Choice(["nt", "turtle", "n3"]), help="RDFLib serialization format")
-def get(organization, weeks, begin, end, file, format):
+@click.option('--workers', default=1, type=click.IntRange(1, None), help="Number of result pages to retrieve concurrently.")
+@click.option('--checkpoint', default=None, help="File to save harvest progress to. Resumes an interrupted harvest and skips records already written. Requires --stream.")
+@click.option('--split', is_flag=True, help="Split the time span into shorter spans when it finds more records than can be retrieved.")
+@click.option('--parallel', default=1, type=click.IntRange(1, None), help="Number of split time spans to query concurrently.")
+@shared_options
+def get(organization, weeks, begin, end, workers, checkpoint, split, parallel,
+        file, format, stream, name_cache, processes, cache_dir, cache_ttl, cache_size, delta_store, retractions,
+        endpoint, protocol, graph, load_batch, load_workers, metrics_file):
     console("\n{}\n".format('-' * 25))
+    metrics.reset()
+
+    check_environment()
+    check_output(file, format, stream, processes, delta_store, retractions, endpoint)
+    if checkpoint is not None and not stream:
+        raise click.BadParameter("--checkpoint requires --stream.")
+    if checkpoint is not None and split:
+        raise click.BadParameter("--checkpoint can not be used with --split.")
+    if checkpoint is not None and processes:
+        raise click.BadParameter("--checkpoint can not be used with --processes.")
 
     out_file = file
     console('Querying for %s.' % organization)
@@ -63,12 +338,187 @@ def get(organization, weeks, begin, end, file, format):
     vspan = valid_span(begin, end)
     if vspan is not None:
         console("Querying with start date {} and end date {}.".format(vspan['begin'], vspan['end']))
-        get_triples(organization, out_file, span=vspan, format=format)
     else:
+        if split:
+            raise click.BadParameter("--split requires --begin and --end.")
         console("Querying for {} weeks.".format(weeks))
-        get_triples(organization, out_file, weeks=weeks, format=format)
+        weeks = int(weeks)
+
+    append = False
+    if checkpoint is not None:
+        from wos2vivo.harvest import org_query
+        checkpoint = Checkpoint(checkpoint)
+        query = org_query(organization)
+        # Continue the output of an interrupted harvest, or add the
+        # new records to the output of a completed one.
+        append = checkpoint.appends(query, weeks=weeks if vspan is None else None, span=vspan)
+        if checkpoint.resumes(query, weeks=weeks if vspan is None else None, span=vspan):
+            console("Resuming harvest after record {}.".format(checkpoint.offset))
+
+    records = get_records(
+        organization,
+        weeks=weeks,
+        span=vspan,
+        workers=workers,
+        checkpoint=checkpoint,
+        cache=response_cache(cache_dir, cache_ttl, cache_size),
+        split=split,
+        parallel=parallel
+    )
+    with persistent_names(name_cache):
+        write_records(
+            records,
+            out_file,
+            format=format,
+            stream=stream,
+            append=append,
+            processes=processes,
+            checkpoint=checkpoint,
+            delta_store=delta_store,
+            retractions=retractions,
+            loader=sparql_loader(endpoint, protocol, graph, load_batch, load_workers)
+        )
+    report_metrics(metrics_file)
+
+    console("\n{}\n".format('-' * 25))
+
+
+def read_batch(path, weeks):
+    """
+    Read a batch file of organizations. One organization per line,
+    optionally followed by a begin and end date, comma separated:
+
+        University of Florida
+        University of Florida Health,2016-03-01,2016-03-31
+
+    Organizations without dates are searched for the given weeks.
+    Blank lines and lines starting with # are skipped.
+    """
+    orgs = []
+    with open(path, 'rb') as f:
+        for row in csv.reader(f):
+            if (not row) or (not row[0].strip()) or row[0].startswith('#'):
+                continue
+            row = [col.strip().decode('utf-8') for col in row]
+            name = row[0]
+            dates = [col or None for col in row[1:3]]
+            span = valid_span(*(dates + [None] * (2 - len(dates))))
+            if span is not None:
+                orgs.append(dict(name=name, span=span))
+            else:
+                orgs.append(dict(name=name, weeks=int(weeks)))
+    return orgs
+
 
+@click.command(help="Pass in a file of organization enhanced names from the Web of Science, one per line with optional begin and end dates.")
+@click.argument('organizations', type=click.Path(exists=True, dir_okay=False))
+@click.option('--weeks', default="1", type=click.Choice(["1", "2", "4"]), help='Number of previous weeks to search for organizations without dates.')
+@click.option('--workers', default=1, type=click.IntRange(1, None), help="Number of result pages to retrieve concurrently per organization.")
+@click.option('--parallel', default=1, type=click.IntRange(1, None), help="Number of organizations to query concurrently.")
+@click.option('--split', is_flag=True, help="Split the time spans of organizations with dates into shorter spans when they find more records than can be retrieved.")
+@shared_options
+def batch(organizations, weeks, workers, parallel, split,
+          file, format, stream, name_cache, processes, cache_dir, cache_ttl, cache_size, delta_store, retractions,
+          endpoint, protocol, graph, load_batch, load_workers, metrics_file):
     console("\n{}\n".format('-' * 25))
+    metrics.reset()
+
+    check_environment()
+    check_output(file, format, stream, processes, delta_store, retractions, endpoint)
+
+    orgs = read_batch(organizations, weeks)
+    console("Querying for {} organizations.".format(len(orgs)))
+    cache = response_cache(cache_dir, cache_ttl, cache_size)
+    from wos2vivo.harvest import get_publications_for_orgs
+    records = get_publications_for_orgs(orgs, workers=workers, parallel=parallel, cache=cache, split=split)
+    with persistent_names(name_cache):
+        write_records(
+            records,
+            file,
+            format=format,
+            stream=stream,
+            processes=processes,
+            delta_store=delta_store,
+            retractions=retractions,
+            loader=sparql_loader(endpoint, protocol, graph, load_batch, load_workers)
+        )
+    report_metrics(metrics_file)
+
+    console("\n{}\n".format('-' * 25))
+
+
+def read_identifiers(path):
+    """
+    Read a file of DOIs and UTs, one per line. Blank lines and lines
+    starting with # are skipped.
+    """
+    identifiers = []
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if (not line) or line.startswith('#'):
+                continue
+            identifiers.append(line.decode('utf-8'))
+    return identifiers
+
+
+def report_not_found(finder, path=None):
+    """
+    Print how many identifiers were found and save the ones that were
+    not to path, one per line.
+
+    :param finder: lookup.Lookup
+    """
+    missing = finder.not_found
+    console("{} of {} identifiers found.".format(len(finder.found), len(finder.identifiers)))
+    for identifier in finder.invalid:
+        console("Can not search for {!r}.".format(identifier))
+    if path is not None:
+        with open(path, 'wb') as f:
+            for identifier in missing:
+                f.write(identifier.encode('utf-8') + "\n")
+        console("{} identifiers not found saved to {}.".format(len(missing), path))
+    elif missing:
+        console("Not found: {}{}".format(", ".join(missing[:10]), " ..." if len(missing) > 10 else ""))
+
+
+@click.command(help="Pass in a file of DOIs and Web of Science UTs, one per line, to look up and map.")
+@click.argument('identifiers', type=click.Path(exists=True, dir_okay=False))
+@click.option('--workers', default=1, type=click.IntRange(1, None), help="Number of result pages to retrieve concurrently per query.")
+@click.option('--parallel', default=1, type=click.IntRange(1, None), help="Number of queries to run concurrently.")
+@click.option('--query-length', default=QUERY_LENGTH, type=click.IntRange(100, None), help="Longest query identifiers are combined into, in characters.")
+@click.option('--not-found', default=None, help="File to save identifiers no record was found for to.")
+@shared_options
+def lookup(identifiers, workers, parallel, query_length, not_found,
+           file, format, stream, name_cache, processes, cache_dir, cache_ttl, cache_size, delta_store, retractions,
+           endpoint, protocol, graph, load_batch, load_workers, metrics_file):
+    console("\n{}\n".format('-' * 25))
+    metrics.reset()
+
+    check_environment()
+    check_output(file, format, stream, processes, delta_store, retractions, endpoint)
+
+    from wos2vivo.lookup import Lookup
+    finder = Lookup(read_identifiers(identifiers), length=query_length)
+    console("Looking up {} identifiers in {} queries.".format(len(finder.identifiers), len(finder.queries)))
+    cache = response_cache(cache_dir, cache_ttl, cache_size)
+    records = finder.records(workers=workers, parallel=parallel, cache=cache)
+    with persistent_names(name_cache):
+        write_records(
+            records,
+            file,
+            format=format,
+            stream=stream,
+            processes=processes,
+            delta_store=delta_store,
+            retractions=retractions,
+            loader=sparql_loader(endpoint, protocol, graph, load_batch, load_workers)
+        )
+    report_not_found(finder, not_found)
+    report_metrics(metrics_file)
+
+    console("\n{}\n".format('-' * 25))
+
 
 if __name__ == '__main__':
     get()
\ No newline at end of file
@@ -2,6 +2,41 @@
 AUTH_URL = 'http://search.webofknowledge.com/esti/wokmws/ws/WOKMWSAuthenticate?wsdl'
 SEARCH_URL = 'http://search.webofknowledge.com/esti/wokmws/ws/WokSearchLite?wsdl'
 
+# Request scheduling. The service allows a limited number of requests
+# a second per session.
+REQUESTS_PER_SECOND = 2
+# Queries per session before a new session is started. None for no limit.
+SESSION_QUERY_LIMIT = None
+# Seconds to wait for the service to respond.
+TIMEOUT = 300
+
+# Records one query id can page through with Retrieve. Larger time
+# span harvests are split into shorter spans below this limit.
+RETRIEVE_LIMIT = 100000
+
+# Longest userQuery, in characters, identifier lookups pack
+# identifiers into.
+QUERY_LENGTH = 4000
+
+# Retries of transient failures, with exponential backoff starting at
+# BACKOFF seconds.
+RETRIES = 5
+BACKOFF = 1.0
+RETRY_STATUS = [502, 503, 504]
+
+# Formats utils.StreamWriter can write record by record.
+STREAM_FORMATS = ["nt", "turtle"]
+
+# Protocols of loader.SparqlLoader.
+# update: POST INSERT DATA requests to a SPARQL Update endpoint.
+# graph-store: POST N-Triples to a Graph Store Protocol endpoint.
+PROTOCOLS = ["update", "graph-store"]
+
+# SOAP fault strings that mean the request was throttled or the
+# session id is no longer valid.
+THROTTLE_FAULTS = ["Throttle"]
+SESSION_FAULTS = ["SessionServer", "(SID)"]
+
 # SOAP message for authenticating.
 AUTHENTICATE = """
 <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
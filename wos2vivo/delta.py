@@ -0,0 +1,104 @@
+"""
+Write only the triples that changed since the last export.
+"""
+
+import anydbm
+import hashlib
+import zlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+from metrics import metrics
+
+
+def _lines(nt):
+    return set(line.strip() for line in nt.splitlines() if line.strip())
+
+
+class DeltaStore(object):
+    """
+    Content hash and compressed N-Triples of every exported record,
+    keyed on UT, in a dbm file.
+    """
+
+    def __init__(self, path):
+        self.db = anydbm.open(path, 'c')
+
+    def get(self, ut):
+        """
+        :return: (str, set) hash and N-Triples lines, or None
+        """
+        value = self.db.get(ut.encode('utf-8'))
+        if value is None:
+            return None
+        digest, nt = value.split(':', 1)
+        return digest, _lines(zlib.decompress(nt))
+
+    def set(self, ut, digest, lines):
+        self.db[ut.encode('utf-8')] = digest + ':' + zlib.compress("\n".join(sorted(lines)))
+
+    def close(self):
+        self.db.close()
+
+
+class Delta(object):
+    """
+    Compare mapped records with a DeltaStore and write the triples to
+    add and to retract as N-Triples.
+
+    Only triples about the record's own resources (the publication,
+    its authorships, vcards and date) are retracted. Triples about
+    resources other records share, such as a journal, stay.
+    """
+
+    def __init__(self, store, additions, retractions):
+        """
+        :param store: DeltaStore
+        :param additions: file-like object
+        :param retractions: file-like object
+        """
+        self.store = store
+        self.additions = additions
+        self.retractions = retractions
+        self.new = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.added = 0
+        self.retracted = 0
+
+    @staticmethod
+    def _own(line, localid):
+        """
+        Determine if a triple is about one of the record's resources.
+        """
+        subject = line.split(' ', 1)[0]
+        return subject.endswith(localid + '>')
+
+    def write(self, rec):
+        """
+        :param rec: record.Record
+        """
+        with metrics.timer('map_seconds'):
+            lines = _lines(rec.to_nt())
+        metrics.incr('records_mapped')
+        digest = hashlib.sha1("\n".join(sorted(lines))).hexdigest()
+        previous = self.store.get(rec.ut())
+        if previous is None:
+            self.new += 1
+            added, retracted = lines, set()
+        elif previous[0] == digest:
+            self.unchanged += 1
+            return
+        else:
+            self.changed += 1
+            added = lines - previous[1]
+            retracted = set(l for l in previous[1] - lines if self._own(l, rec.localid))
+        for line in sorted(added):
+            self.additions.write(line + "\n")
+        for line in sorted(retracted):
+            self.retractions.write(line + "\n")
+        self.added += len(added)
+        self.retracted += len(retracted)
+        metrics.incr('triples', len(added) + len(retracted))
+        self.store.set(rec.ut(), digest, lines)
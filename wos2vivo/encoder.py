@@ -0,0 +1,186 @@
+"""
+Serialize graphs to N-Triples and Turtle without rdflib's serializers.
+
+wos2vivo graphs only hold URIs and literals from a few vocabularies,
+so terms are encoded with a few string operations. Encoded URIs are
+cached, and output is written in buffered chunks. N-Triples are byte
+for byte what rdflib writes. Turtle groups each subject's statements
+and uses the bound prefixes, in the order subjects were added.
+"""
+
+import re
+
+from rdflib import BNode, Literal, URIRef, RDF
+# Registers the _rdflib_nt_escape error handler used for non-ASCII
+# characters in N-Triples.
+import rdflib.plugins.serializers.nt
+
+from record import INVALID_URI
+
+# Formats the Encoder writes.
+FORMATS = ["nt", "turtle"]
+
+# Triples encoded per chunk written to the destination.
+CHUNK_TRIPLES = 10000
+
+# Encoded URIs kept before the cache starts over.
+CACHE_SIZE = 100000
+
+# Local names that can be written as prefixed names.
+LOCAL_NAME = re.compile(u"^[A-Za-z0-9_](?:[A-Za-z0-9_\\-]*[A-Za-z0-9_\\-])?$")
+
+
+def _quote(value):
+    return u'"{}"'.format(
+        value.replace(u'\\', u'\\\\').replace(u'\n', u'\\n').replace(u'"', u'\\"').replace(u'\r', u'\\r')
+    )
+
+
+class Encoder(object):
+    """
+    Encode triples of URIs, blank nodes and literals. Raises
+    ValueError for anything else, e.g. a URI rdflib would refuse to
+    serialize, so callers can fall back to rdflib.
+    """
+
+    def __init__(self, prefixes):
+        """
+        :param prefixes: list of (prefix, namespace) for Turtle
+        """
+        self.prefixes = prefixes
+        # Longest namespace first, so the most specific one is used.
+        self._namespaces = sorted(
+            [(unicode(namespace), prefix) for prefix, namespace in prefixes],
+            key=lambda item: len(item[0]),
+            reverse=True
+        )
+        self._nt = {}
+        self._turtle = {}
+
+    @staticmethod
+    def _cache(cache, term, value):
+        if len(cache) >= CACHE_SIZE:
+            cache.clear()
+        cache[term] = value
+        return value
+
+    def nt_term(self, term):
+        """
+        :param term: rdflib term
+        :return: unicode
+        """
+        if isinstance(term, Literal):
+            if term.language:
+                return u"{}@{}".format(_quote(term), term.language)
+            elif term.datatype:
+                return u"{}^^{}".format(_quote(term), self.nt_term(term.datatype))
+            return _quote(term)
+        out = self._nt.get(term)
+        if out is not None:
+            return out
+        if isinstance(term, URIRef):
+            if INVALID_URI.search(term):
+                raise ValueError("Invalid URI {}.".format(term.encode('utf-8')))
+            return self._cache(self._nt, term, u"<{}>".format(term))
+        elif isinstance(term, BNode):
+            return u"_:{}".format(term)
+        raise ValueError("Can not encode {!r}.".format(term))
+
+    def turtle_term(self, term):
+        """
+        Prefixed name for URIs in a bound namespace, otherwise the
+        N-Triples form.
+        :param term: rdflib term
+        :return: unicode
+        """
+        if isinstance(term, Literal):
+            if term.datatype and not term.language:
+                return u"{}^^{}".format(_quote(term), self.turtle_term(term.datatype))
+            return self.nt_term(term)
+        out = self._turtle.get(term)
+        if out is not None:
+            return out
+        out = self.nt_term(term)
+        if isinstance(term, URIRef):
+            for namespace, prefix in self._namespaces:
+                if term.startswith(namespace) and LOCAL_NAME.match(term[len(namespace):]):
+                    out = u"{}:{}".format(prefix, term[len(namespace):])
+                    break
+            self._cache(self._turtle, term, out)
+        return out
+
+    def ntriples(self, triples):
+        """
+        :param triples: iterable of (s, p, o)
+        :return: generator of str chunks
+        """
+        nt = self.nt_term
+        rows = []
+        for s, p, o in triples:
+            rows.append(u"{} {} {} .\n".format(nt(s), nt(p), nt(o)))
+            if len(rows) >= CHUNK_TRIPLES:
+                yield u"".join(rows).encode("ascii", "_rdflib_nt_escape")
+                rows = []
+        if rows:
+            yield u"".join(rows).encode("ascii", "_rdflib_nt_escape")
+
+    def header(self):
+        """
+        :return: str Turtle prefix declarations
+        """
+        lines = [u"@prefix {}: <{}> .".format(prefix, namespace) for prefix, namespace in self.prefixes]
+        return (u"\n".join(lines) + u"\n\n").encode("utf-8")
+
+    def turtle(self, triples, header=True):
+        """
+        :param triples: iterable of (s, p, o)
+        :param header: boolean write the prefix declarations
+        :return: generator of str chunks
+        """
+        # Subjects in the order they are first seen.
+        order = []
+        subjects = {}
+        for s, p, o in triples:
+            predicates = subjects.get(s)
+            if predicates is None:
+                predicates = subjects[s] = {}
+                order.append(s)
+            objects = predicates.get(p)
+            if objects is None:
+                objects = predicates[p] = []
+            objects.append(o)
+        if header:
+            yield self.header()
+        ttl = self.turtle_term
+        blocks = []
+        count = 0
+        for s in order:
+            predicates = subjects.pop(s)
+            statements = []
+            # Types first, as rdflib writes them.
+            types = predicates.pop(RDF.type, None)
+            if types is not None:
+                statements.append(u"a {}".format(u",\n        ".join(ttl(o) for o in types)))
+                count += len(types)
+            for p, objects in predicates.iteritems():
+                statements.append(u"{} {}".format(ttl(p), u",\n        ".join(ttl(o) for o in objects)))
+                count += len(objects)
+            blocks.append(u"{} {} .\n\n".format(ttl(s), u" ;\n    ".join(statements)))
+            if count >= CHUNK_TRIPLES:
+                yield u"".join(blocks).encode("utf-8")
+                blocks = []
+                count = 0
+        if blocks:
+            yield u"".join(blocks).encode("utf-8")
+
+    def encode(self, triples, format="nt"):
+        """
+        :param triples: iterable of (s, p, o)
+        :param format: str one of FORMATS
+        :return: generator of str chunks
+        """
+        if format == "nt":
+            return self.ntriples(triples)
+        elif format == "turtle":
+            return self.turtle(triples)
+        raise ValueError("The encoder writes {} formats.".format(", ".join(FORMATS)))
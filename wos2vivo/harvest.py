@@ -1,56 +1,453 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from client import WoSSession, QueryResponse
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+from client import WoSSession, QueryResponse, StreamingQueryResponse, SessionExpired
+from constants import RETRIEVE_LIMIT
+from metrics import metrics
+from pipeline import prefetched
 from query import Query, Retrieve
 
 
-def get_publications(query, weeks=None, span=None, batch_size=100):
+def _page_offsets(found, batch_size):
+    """
+    The firstRecord offsets of the pages that follow the first page
+    of a query.
+
+    :param found: int
+    :param batch_size: int
+    :return: list
+    """
+    return range(batch_size + 1, found + 1, batch_size)
+
+
+class _RunningQuery(object):
+    """
+    A query and the id the service gave it. WoS query ids belong to a
+    session, so the query is run again for a new id when the session
+    expires in the middle of a harvest.
+
+    When the session has a response cache, pages are looked up by the
+    normalized query parameters and the page offset, and the query is
+    only run on the service once a page is not in the cache.
+    """
+
+    def __init__(self, session, query, query_id=None):
+        self.session = session
+        self.query_doc = query.to_string()
+        self.cache_key = query.cache_key()
+        self._lock = Lock()
+        self._set(query_id)
+
+    def _set(self, query_id):
+        # The query id and the session generation that issued it.
+        self.current = (query_id, self.session.generation)
+
+    @property
+    def query_id(self):
+        return self.current[0]
+
+    def renew(self, stale_id):
+        with self._lock:
+            # Another thread may have renewed it already.
+            if self.query_id == stale_id:
+                rsp = QueryResponse(self.session.query(self.query_doc))
+                logger.info("Query id renewed, {} records found.".format(rsp.found))
+                self._set(rsp.query_id)
+
+    def retrieve(self, send, start, batch_size):
+        """
+        Send a Retrieve message for a page of the query.
+
+        :param send: WoSSession.query, query_content or query_stream
+        :param start: int
+        :param batch_size: int
+        """
+        logger.debug("Batch start {}. Batch size {}.".format(start, batch_size))
+        if self.query_id is None:
+            # The first page came from the cache.
+            self.renew(None)
+        query_id, generation = self.current
+        try:
+            return send(Retrieve(query_id, start=start, count=batch_size).to_string())
+        except SessionExpired:
+            pass
+        except Exception:
+            # Another thread may have started a new session, which
+            # makes the query id of the old session invalid.
+            if self.session.generation == generation:
+                raise
+        self.renew(query_id)
+        return send(Retrieve(self.query_id, start=start, count=batch_size).to_string())
+
+    def _cached(self, start, fetch):
+        """
+        Response body of a page from the cache, or fetched and
+        added to the cache.
+        """
+        key = u"{}|firstRecord={}".format(self.cache_key, start)
+        body = self.session.cache.get(key)
+        if body is None:
+            body = fetch()
+            self.session.cache.set(key, body)
+        return body
+
+    @contextmanager
+    def first_page(self):
+        """
+        Run the query and read its first page.
+        :return: StreamingQueryResponse
+        """
+        if self.session.cache is None:
+            with _streaming(self.session.query_stream(self.query_doc)) as query_response:
+                self._set(query_response.query_id)
+                yield query_response
+            return
+        fetched = []
+
+        def fetch():
+            fetched.append(True)
+            return self.session.query_content(self.query_doc)
+        query_response = StreamingQueryResponse(BytesIO(self._cached(1, fetch)))
+        if fetched:
+            self._set(query_response.query_id)
+        yield query_response
+
+    def page(self, start, batch_size):
+        """
+        A page of the query, read whole.
+        :return: QueryResponse or StreamingQueryResponse
+        """
+        if self.session.cache is None:
+            # query_content raises on faults, so a stale query id is
+            # renewed inside retrieve.
+            return QueryResponse(self.retrieve(self.session.query_content, start, batch_size))
+        body = self._cached(start, lambda: self.retrieve(self.session.query_content, start, batch_size))
+        return StreamingQueryResponse(BytesIO(body))
+
+    @contextmanager
+    def streaming_page(self, start, batch_size):
+        """
+        A page of the query, parsed as it is read from the connection
+        unless it comes from the cache.
+        :return: StreamingQueryResponse
+        """
+        if self.session.cache is not None:
+            yield self.page(start, batch_size)
+            return
+        with _streaming(self.retrieve(self.session.query_stream, start, batch_size)) as retrieve_response:
+            yield retrieve_response
+
+
+@contextmanager
+def _streaming(rsp):
+    """
+    Parse a response as it arrives.
+
+    :param rsp: requests.Response from WoSSession.query_stream
+    :return: StreamingQueryResponse
+    """
+    try:
+        yield StreamingQueryResponse(rsp.raw)
+    finally:
+        # Bytes read from the connection.
+        metrics.incr('bytes_received', rsp.raw.tell())
+        rsp.close()
+
+
+def _retrieve_pages(running, offsets, batch_size, workers=1):
+    """
+    Retrieve the remaining pages of a query, in offset order.
+
+    With one worker each page is parsed as it is read from the
+    connection. With more than one worker the Retrieve calls are
+    sent through a thread pool. At most workers * 2 pages are
+    requested ahead of the page being consumed, so memory stays
+    bounded when the consumer is slower than the service.
+
+    :param running: _RunningQuery
+    :param offsets: list of firstRecord offsets
+    :param batch_size: int
+    :param workers: int
+    :return: (int, QueryResponse) offset and page
+    """
+    if workers <= 1:
+        for start in offsets:
+            with running.streaming_page(start, batch_size) as retrieve_response:
+                yield start, retrieve_response
+            if retrieve_response.number < batch_size:
+                break
+        return
+
+    pool = ThreadPool(workers)
+    pending = deque()
+    offsets = iter(offsets)
+    try:
+        for start in offsets:
+            pending.append((start, pool.apply_async(running.page, (start, batch_size))))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            start, result = pending.popleft()
+            retrieve_response = result.get()
+            for next_start in offsets:
+                pending.append((next_start, pool.apply_async(running.page, (next_start, batch_size))))
+                break
+            yield start, retrieve_response
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _page_records(records, offset, checkpoint):
+    """
+    Yield the records of one page, skipping the ones a checkpoint has
+    seen, and mark the page done once all of them were consumed.
+    """
+    if checkpoint is None:
+        for rec in records:
+            yield rec
+        return
+    emitted = []
+    for rec in records:
+        if checkpoint.seen(rec.ut()):
+            continue
+        emitted.append(rec.ut())
+        yield rec
+    checkpoint.page_done(offset, emitted)
+
+
+@contextmanager
+def _open_session(session=None, cache=None):
+    """
+    Use an existing, authenticated session or open a new one for the
+    duration of a harvest.
+    """
+    if session is not None:
+        yield session
+    else:
+        with WoSSession(cache=cache) as s:
+            yield s
+
+
+def get_publications(query, weeks=None, span=None, batch_size=100, workers=1, checkpoint=None, session=None, cache=None,
+                     all_years=False):
     """
     Function to get all publications for a given query during a given
     time period.
 
+    Pass a checkpoint.Checkpoint to resume an interrupted harvest of
+    the same query and skip records emitted by earlier runs. Pass an
+    authenticated WoSSession to share it between harvests, otherwise
+    a session is opened and closed for this harvest. Pass a
+    cache.ResponseCache to answer pages from disk where possible.
+    Pass all_years to search without a time span, e.g. for
+    identifiers.
+
     :param query: str
     :param weeks: int
     :param span: dict
     :param batch_size: int
+    :param workers: int number of concurrent Retrieve requests
+    :param checkpoint: checkpoint.Checkpoint
+    :param session: client.WoSSession
+    :param cache: cache.ResponseCache, used when no session is passed
+    :param all_years: bool
     :return: record.Record
     """
-    if (weeks is None) and (span is None):
+    if (weeks is None) and (span is None) and not all_years:
         raise Exception("Invalid query. Weeks or span is required.")
+    resume_after = 0
+    if checkpoint is not None:
+        resume_after = checkpoint.begin(query, weeks=weeks, span=span)
     # Run a query and get all of the records as ntriples.
-    with WoSSession() as s:
-        q = Query(query, weeks=weeks, span=span).to_string()
-        rsp = s.query(q)
-        query_response = QueryResponse(rsp)
-        for rec in query_response.records:
-            yield rec
-        logger.info("Found {} records for query {}.".format(query_response.found, query))
+    with _open_session(session, cache) as s:
+        running = _RunningQuery(s, Query(query, weeks=weeks, span=span, count=batch_size))
+        with running.first_page() as query_response:
+            logger.info("Found {} records for query {}.".format(query_response.found, query))
+            if query_response.found > RETRIEVE_LIMIT:
+                logger.warning(
+                    "Only the first {} of {} records can be retrieved. Split the time span into shorter spans.".format(
+                        RETRIEVE_LIMIT,
+                        query_response.found
+                    )
+                )
+            if resume_after < 1:
+                for rec in _page_records(query_response.records, 1, checkpoint):
+                    yield rec
 
         # Page through the results sets to get all the records for given query params.
-        queries = 1
-        while True:
-            start = (batch_size * queries) + 1
-            # Break now if we don't have more records to fetch.
-            if start >= query_response.found:
-                break
-            logger.debug("Batch start {}. Batch size {}.".format(start, batch_size))
-            # Build retrieve query
-            rq = Retrieve(query_response.query_id, start=start, count=batch_size).to_string()
-            rsp = s.query(rq)
-            # Retrieve response
-            retrieve_response = QueryResponse(rsp)
-            for rec in retrieve_response.records:
+        # Every offset is known once the first response tells us how many were found.
+        found = min(query_response.found, RETRIEVE_LIMIT)
+        offsets = [start for start in _page_offsets(found, batch_size) if start > resume_after]
+        for start, retrieve_response in _retrieve_pages(
+                running,
+                offsets,
+                batch_size,
+                workers=workers
+        ):
+            for rec in _page_records(retrieve_response.records, start, checkpoint):
                 yield rec
-            if retrieve_response.number < batch_size:
-                break
-            queries += 1
+
+    if checkpoint is not None:
+        checkpoint.finish()
+
+
+def org_query(org_name):
+    """
+    User query for an organization enhanced name.
+    """
+    return "OG={}".format(org_name)
 
 
-def get_publications_for_org(org_name, weeks=None, span=None, batch_size=100):
+def get_publications_for_org(org_name, weeks=None, span=None, batch_size=100, workers=1, checkpoint=None, session=None, cache=None):
     return get_publications(
-        "OG={}".format(org_name),
+        org_query(org_name),
         weeks=weeks,
         span=span,
-        batch_size=batch_size
+        batch_size=batch_size,
+        workers=workers,
+        checkpoint=checkpoint,
+        session=session,
+        cache=cache
     )
+
+
+def _split_span(span):
+    """
+    Bisect a time span into two consecutive spans.
+
+    :param span: dict with begin and end dates, e.g. 2016-03-15
+    :return: tuple of two span dicts, or None for a single day
+    """
+    begin = datetime.strptime(span['begin'], "%Y-%m-%d").date()
+    end = datetime.strptime(span['end'], "%Y-%m-%d").date()
+    if begin >= end:
+        return None
+    middle = begin + timedelta(days=(end - begin).days // 2)
+    return (
+        dict(begin=begin.isoformat(), end=middle.isoformat()),
+        dict(begin=(middle + timedelta(days=1)).isoformat(), end=end.isoformat())
+    )
+
+
+def _records_found(session, query, span):
+    """
+    Number of records a query finds in a time span.
+    """
+    running = _RunningQuery(session, Query(query, span=span, count=1))
+    with running.first_page() as query_response:
+        return query_response.found
+
+
+def plan_spans(session, query, span, limit=RETRIEVE_LIMIT):
+    """
+    Split a time span into consecutive spans that each find no more
+    records than can be retrieved with one query id. Spans over the
+    limit are bisected until they are under it or a single day.
+
+    :param session: client.WoSSession
+    :param query: str
+    :param span: dict with begin and end dates
+    :param limit: int
+    :return: list of (span, found) tuples in date order
+    """
+    found = _records_found(session, query, span)
+    if found <= limit:
+        return [(span, found)]
+    halves = _split_span(span)
+    if halves is None:
+        logger.warning("{} records found for {} on {}. Only the first {} can be retrieved.".format(
+            found, query, span['begin'], limit))
+        return [(span, found)]
+    logger.debug("{} records found for {} from {} to {}. Splitting span.".format(
+        found, query, span['begin'], span['end']))
+    return plan_spans(session, query, halves[0], limit) + plan_spans(session, query, halves[1], limit)
+
+
+def _split_orgs(session, orgs, limit=RETRIEVE_LIMIT):
+    """
+    Replace organizations searched by time span with one entry per
+    planned sub-span. Organizations searched by weeks are kept.
+
+    :return: list of dicts with name and weeks or span
+    """
+    out = []
+    for org in orgs:
+        if org.get('span') is None:
+            out.append(org)
+            continue
+        spans = plan_spans(session, org_query(org['name']), org['span'], limit=limit)
+        logger.info("Searching {} in {} time spans.".format(org['name'], len(spans)))
+        for span, found in spans:
+            out.append(dict(name=org['name'], span=span))
+    return out
+
+
+def _harvest_org(session, batch_size, workers, org):
+    """
+    Records for one organization of a batch.
+    :return: generator of record.Record
+    """
+    num = 0
+    for rec in get_publications_for_org(
+        org['name'],
+        weeks=org.get('weeks'),
+        span=org.get('span'),
+        batch_size=batch_size,
+        workers=workers,
+        session=session
+    ):
+        num += 1
+        yield rec
+    logger.info("{} records for {}.".format(num, org['name']))
+
+
+def get_publications_for_orgs(orgs, batch_size=100, workers=1, parallel=1, cache=None, split=False,
+                              limit=RETRIEVE_LIMIT):
+    """
+    Get publications for several organizations over one authenticated
+    session. Up to `parallel` organizations are harvested at once and
+    records found for more than one organization are only returned
+    the first time, in the order the organizations were passed.
+    Records are handed over through bounded queues, see
+    pipeline.prefetched, so organizations that are not consumed yet
+    only hold a few pages each. With one at a time, the harvests run
+    one after the other as their records are consumed.
+
+    With split, time spans that find more records than can be
+    retrieved are first split into shorter spans, see plan_spans,
+    which are harvested like separate organizations.
+
+    :param orgs: list of dicts with name and weeks or span
+    :param batch_size: int
+    :param workers: int number of concurrent Retrieve requests per organization
+    :param parallel: int number of organizations to harvest at once
+    :param cache: cache.ResponseCache
+    :param split: bool
+    :param limit: int records per span when splitting
+    :return: record.Record
+    """
+    seen = set()
+    with WoSSession(cache=cache) as s:
+        if split:
+            orgs = _split_orgs(s, orgs, limit=limit)
+        harvests = (_harvest_org(s, batch_size, workers, org) for org in orgs)
+        if parallel > 1:
+            records = prefetched(harvests, ahead=parallel)
+        else:
+            records = (rec for org_records in harvests for rec in org_records)
+        try:
+            for rec in records:
+                if rec.ut() in seen:
+                    continue
+                seen.add(rec.ut())
+                yield rec
+        finally:
+            records.close()
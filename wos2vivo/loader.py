@@ -0,0 +1,203 @@
+"""
+Load triples into a triple store over SPARQL 1.1 Update or the
+SPARQL 1.1 Graph Store HTTP Protocol.
+"""
+
+import random
+import time
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+import logging
+logger = logging.getLogger(__name__)
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+
+import constants
+from metrics import metrics
+
+
+class SparqlLoader(object):
+    """
+    Send triples to an endpoint in batches of batch_size triples as
+    they are produced, so loading overlaps with the harvest.
+
+    Batches are posted by `workers` threads over pooled connections.
+    At most workers * 2 batches are waiting to be loaded at a time.
+    Failed batches are retried with exponential backoff like Web of
+    Science requests. A batch that still fails raises an Exception
+    from write or close.
+
+    Pass email and password for VIVO's SPARQL Update API, which
+    takes the update and credentials as form parameters.
+
+    Has the write, write_ntriples and close methods of
+    utils.StreamWriter.
+    """
+
+    def __init__(
+            self,
+            endpoint,
+            protocol="update",
+            graph=None,
+            batch_size=10000,
+            workers=2,
+            retries=constants.RETRIES,
+            backoff=constants.BACKOFF,
+            timeout=constants.TIMEOUT,
+            email=None,
+            password=None
+    ):
+        """
+        :param endpoint: str URL
+        :param protocol: str one of constants.PROTOCOLS
+        :param graph: str named graph URI, None for the default graph
+        :param batch_size: int triples per request
+        :param workers: int concurrent requests
+        :param retries: int
+        :param backoff: float seconds before the first retry
+        :param timeout: float seconds
+        :param email: str VIVO account
+        :param password: str VIVO password
+        """
+        if protocol not in constants.PROTOCOLS:
+            raise Exception("Loading supports {} protocols.".format(", ".join(constants.PROTOCOLS)))
+        self.endpoint = endpoint
+        self.protocol = protocol
+        self.graph = graph
+        self.batch_size = batch_size
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.email = email
+        self.password = password
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pool = ThreadPool(workers)
+        self.pending = deque()
+        self._buffer = []
+        # Number of triples written and batches loaded.
+        self.triples = 0
+        self.batches = 0
+        # Number of requests that were retried.
+        self.retried = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        if type is None:
+            self.close()
+        else:
+            self._stop()
+
+    def _request(self, data):
+        """
+        :param data: str N-Triples
+        :return: dict of keyword arguments for Session.post
+        """
+        if self.protocol == "graph-store":
+            params = {"graph": self.graph} if self.graph is not None else {"default": ""}
+            return dict(
+                params=params,
+                data=data,
+                headers={"Content-Type": "application/n-triples"}
+            )
+        if self.graph is not None:
+            update = "INSERT DATA {{ GRAPH <{}> {{\n{}}} }}".format(self.graph, data)
+        else:
+            update = "INSERT DATA {{\n{}}}".format(data)
+        if self.email is not None:
+            return dict(data={"email": self.email, "password": self.password, "update": update})
+        return dict(
+            data=update,
+            headers={"Content-Type": "application/sparql-update"}
+        )
+
+    def _sleep(self, attempt):
+        delay = self.backoff * (2 ** attempt)
+        time.sleep(delay + random.uniform(0, delay))
+
+    def _load(self, lines):
+        """
+        Post one batch, retrying transient failures.
+
+        :param lines: list of N-Triples lines
+        """
+        request = self._request("\n".join(lines) + "\n")
+        attempt = 0
+        while True:
+            try:
+                rsp = self.session.post(self.endpoint, timeout=self.timeout, **request)
+            except (ConnectionError, Timeout) as e:
+                if attempt >= self.retries:
+                    raise
+                logger.warning("Loading batch failed: {}. Retrying.".format(e))
+            else:
+                if 200 <= rsp.status_code < 300:
+                    logger.debug("Loaded batch of {} triples.".format(len(lines)))
+                    return len(lines)
+                if rsp.status_code not in constants.RETRY_STATUS or attempt >= self.retries:
+                    raise Exception("Loading batch failed with status {}:\n{}".format(rsp.status_code, rsp.text))
+                logger.warning("Loading batch failed with status {}. Retrying.".format(rsp.status_code))
+            self.retried += 1
+            self._sleep(attempt)
+            attempt += 1
+
+    def _wait(self):
+        # Raises the exception of a failed batch.
+        self.pending.popleft().get()
+        self.batches += 1
+
+    def _submit(self, lines):
+        if len(self.pending) >= self.workers * 2:
+            self._wait()
+        self.pending.append(self.pool.apply_async(self._load, (lines,)))
+
+    def write(self, graph):
+        """
+        :param graph: rdflib.Graph
+        :return: int number of triples written
+        """
+        with metrics.timer('serialize_seconds'):
+            data = graph.serialize(format="nt")
+        return self.write_ntriples(data, len(graph))
+
+    def write_ntriples(self, data, count):
+        """
+        :param data: str N-Triples
+        :param count: int number of triples
+        :return: int number of triples written
+        """
+        if count == 0:
+            return 0
+        self._buffer.extend(line for line in data.splitlines() if line.strip())
+        while len(self._buffer) >= self.batch_size:
+            self._submit(self._buffer[:self.batch_size])
+            self._buffer = self._buffer[self.batch_size:]
+        self.triples += count
+        metrics.incr('triples', count)
+        return count
+
+    def _stop(self):
+        self.pool.terminate()
+        self.pool.join()
+        self.session.close()
+
+    def close(self):
+        """
+        Load the last batch and wait for all batches to finish.
+        """
+        try:
+            if self._buffer:
+                self._submit(self._buffer)
+                self._buffer = []
+            while self.pending:
+                self._wait()
+        finally:
+            self._stop()
@@ -0,0 +1,188 @@
+"""
+Look up publications by DOI or Web of Science UT in bulk.
+
+Identifiers are packed into OR-combined DO= and UT= queries, so a
+list of thousands of identifiers takes a few queries rather than one
+query per identifier.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from client import WoSSession
+from constants import QUERY_LENGTH
+from harvest import get_publications
+from pipeline import prefetched
+
+# Field tags of the identifiers.
+DOI = "DO"
+UT = "UT"
+
+# Prefixes of DOIs written as links or with a scheme.
+DOI_PREFIXES = ["https://doi.org/", "http://doi.org/", "https://dx.doi.org/", "http://dx.doi.org/", "doi:"]
+
+
+def normalize(identifier):
+    """
+    Field tag and normalized form of an identifier. DOIs start with
+    10. and are case insensitive, anything else is taken for a UT.
+
+    :param identifier: str DOI or UT, e.g. 10.1016/j.ijrobp.2015.12.247 or WOS:000371581900197
+    :return: (str, str) tag and identifier, or None if it can not be searched
+    """
+    value = identifier.strip()
+    for prefix in DOI_PREFIXES:
+        if value.lower().startswith(prefix):
+            value = value[len(prefix):]
+            break
+    if (not value) or ('"' in value):
+        return None
+    if value.startswith("10."):
+        return DOI, value.lower()
+    value = value.upper()
+    if ':' not in value:
+        value = "WOS:" + value
+    return UT, value
+
+
+def record_keys(rec):
+    """
+    The normalized identifiers a record matches.
+
+    :param rec: record.Record
+    :return: list of (tag, identifier)
+    """
+    keys = [(UT, rec.ut().upper())]
+    doi = rec.doi()
+    if doi is not None:
+        keys.append((DOI, doi.strip().lower()))
+    return keys
+
+
+def pack_queries(tag, values, length=QUERY_LENGTH):
+    """
+    Combine identifiers into as few queries as fit in length
+    characters, e.g. DO=("10.1/a" OR "10.1/b"). An identifier longer
+    than that gets a query of its own.
+
+    :param tag: str field tag
+    :param values: list of str normalized identifiers
+    :param length: int longest query
+    :return: list of str queries
+    """
+    queries = []
+    terms = []
+    size = 0
+    # DO=( and )
+    overhead = len(tag) + 3
+    for value in values:
+        term = u'"{}"'.format(value)
+        # Joined with " OR ".
+        added = len(term) + (4 if terms else 0)
+        if terms and overhead + size + added > length:
+            queries.append(u"{}=({})".format(tag, u" OR ".join(terms)))
+            terms = []
+            size = 0
+            added = len(term)
+        terms.append(term)
+        size += added
+    if terms:
+        queries.append(u"{}=({})".format(tag, u" OR ".join(terms)))
+    return queries
+
+
+def _harvest_query(session, batch_size, workers, query):
+    """
+    All records for one packed query.
+    :return: generator of record.Record
+    """
+    return get_publications(
+        query,
+        batch_size=batch_size,
+        workers=workers,
+        session=session,
+        all_years=True
+    )
+
+
+class Lookup(object):
+    """
+    Find the publications of a list of DOIs and UTs.
+
+    Iterate over records() to run the queries. Afterwards, found
+    holds the normalized identifiers records matched, not_found lists
+    the identifiers no record matched and invalid the ones that could
+    not be searched for.
+    """
+
+    def __init__(self, identifiers, length=QUERY_LENGTH):
+        """
+        :param identifiers: iterable of str DOIs and UTs
+        :param length: int longest query
+        """
+        self.identifiers = []
+        self.invalid = []
+        # Normalized identifier to the identifiers as passed.
+        self._keys = {}
+        for identifier in identifiers:
+            key = normalize(identifier)
+            if key is None:
+                self.invalid.append(identifier)
+                continue
+            if key not in self._keys:
+                self._keys[key] = []
+                self.identifiers.append(key)
+            self._keys[key].append(identifier)
+        self.queries = []
+        for tag in [DOI, UT]:
+            values = [value for t, value in self.identifiers if t == tag]
+            self.queries.extend(pack_queries(tag, values, length=length))
+        self.found = set()
+
+    @property
+    def not_found(self):
+        """
+        :return: list of str identifiers, as passed, no record matched
+        """
+        missing = []
+        for key in self.identifiers:
+            if key not in self.found:
+                missing.extend(self._keys[key])
+        return missing
+
+    def records(self, batch_size=100, workers=1, parallel=1, cache=None):
+        """
+        Run the queries over one authenticated session, `parallel`
+        at a time. Queries running ahead of the one being returned
+        hand over their records through bounded queues. Records found
+        by more than one query are only returned once.
+
+        :param batch_size: int
+        :param workers: int number of concurrent Retrieve requests per query
+        :param parallel: int number of queries to run at once
+        :param cache: cache.ResponseCache
+        :return: record.Record
+        """
+        logger.info("Looking up {} identifiers in {} queries.".format(len(self.identifiers), len(self.queries)))
+        if self.invalid:
+            logger.warning("{} identifiers can not be searched for.".format(len(self.invalid)))
+        if not self.queries:
+            return
+        seen = set()
+        with WoSSession(cache=cache) as s:
+            harvests = (_harvest_query(s, batch_size, workers, query) for query in self.queries)
+            if parallel > 1:
+                records = prefetched(harvests, ahead=parallel)
+            else:
+                records = (rec for query_records in harvests for rec in query_records)
+            try:
+                for rec in records:
+                    for key in record_keys(rec):
+                        if key in self._keys:
+                            self.found.add(key)
+                    if rec.ut() in seen:
+                        continue
+                    seen.add(rec.ut())
+                    yield rec
+            finally:
+                records.close()
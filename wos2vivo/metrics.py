@@ -0,0 +1,150 @@
+"""
+Counters and timers for the stages of a harvest.
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+# Counters and their descriptions.
+COUNTERS = [
+    ("requests", "Web of Science requests sent."),
+    ("retries", "Web of Science requests retried."),
+    ("bytes_received", "Bytes of Web of Science responses read."),
+    ("cache_hits", "Responses answered from the response cache."),
+    ("records_parsed", "Records parsed from responses."),
+    ("records_mapped", "Records mapped to RDF."),
+    ("triples", "Triples written or loaded."),
+]
+
+# Timers and their descriptions.
+TIMERS = [
+    ("query_seconds", "Time to the response of Query requests, with retries."),
+    ("retrieve_seconds", "Time to the response of Retrieve requests, with retries."),
+    ("map_seconds", "Time mapping a record to RDF."),
+    ("serialize_seconds", "Time serializing and writing triples."),
+]
+
+
+class Metrics(object):
+    """
+    Thread safe counters and timers. Timers keep the number of
+    observations, their sum and the largest one.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters = dict((name, 0) for name, _ in COUNTERS)
+            self.timers = dict((name, [0, 0.0, 0.0]) for name, _ in TIMERS)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, seconds, count=1):
+        """
+        :param name: str timer
+        :param seconds: float
+        :param count: int number of observations the time covers
+        """
+        with self._lock:
+            timer = self.timers[name]
+            timer[0] += count
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds / count if count else seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start)
+
+    def summary(self):
+        """
+        :return: dict of counters, timers and derived rates
+        """
+        with self._lock:
+            elapsed = time.time() - self.started
+            out = dict(self.counters)
+            for name, (count, total, longest) in self.timers.items():
+                out[name] = dict(
+                    count=count,
+                    total=round(total, 6),
+                    mean=round(total / count, 6) if count else 0.0,
+                    max=round(longest, 6)
+                )
+        out['elapsed_seconds'] = round(elapsed, 3)
+        out['records_per_second'] = round(out['records_parsed'] / elapsed, 3) if elapsed else 0.0
+        return out
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix="wos2vivo"):
+        """
+        The metrics in the Prometheus text exposition format, e.g. for
+        the node exporter's textfile collector.
+        """
+        summary = self.summary()
+        lines = []
+        for name, description in COUNTERS:
+            metric = "{}_{}_total".format(prefix, name)
+            lines.append("# HELP {} {}".format(metric, description))
+            lines.append("# TYPE {} counter".format(metric))
+            lines.append("{} {}".format(metric, summary[name]))
+        for name, description in TIMERS:
+            metric = "{}_{}".format(prefix, name)
+            lines.append("# HELP {} {}".format(metric, description))
+            lines.append("# TYPE {} summary".format(metric))
+            lines.append("{}_count {}".format(metric, summary[name]['count']))
+            lines.append("{}_sum {}".format(metric, summary[name]['total']))
+        for name in ["elapsed_seconds", "records_per_second"]:
+            metric = "{}_{}".format(prefix, name)
+            lines.append("# TYPE {} gauge".format(metric))
+            lines.append("{} {}".format(metric, summary[name]))
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        """
+        Write the metrics to path, in the Prometheus text format if
+        the file name ends in .prom and as JSON otherwise. The file is
+        replaced atomically so a collector never reads it half written.
+        """
+        if path.endswith(".prom"):
+            out = self.to_prometheus()
+        else:
+            out = self.to_json()
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(out)
+        os.rename(tmp, path)
+
+    def report(self):
+        """
+        Human readable summary lines.
+        :return: list of str
+        """
+        s = self.summary()
+        return [
+            "{} requests, {} retried, {} answered from cache, {:.1f} MB received.".format(
+                s['requests'], s['retries'], s['cache_hits'], s['bytes_received'] / 1048576.0),
+            "Query {:.3f}s and Retrieve {:.3f}s mean response time.".format(
+                s['query_seconds']['mean'], s['retrieve_seconds']['mean']),
+            "{} records parsed, {:.1f} records a second.".format(s['records_parsed'], s['records_per_second']),
+            "{} records mapped, {:.2f}ms a record. {} triples written, {:.3f}s serializing.".format(
+                s['records_mapped'], s['map_seconds']['mean'] * 1000, s['triples'], s['serialize_seconds']['total']),
+            "Finished in {:.1f}s.".format(s['elapsed_seconds']),
+        ]
+
+
+# Metrics of this process.
+metrics = Metrics()
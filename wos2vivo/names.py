@@ -0,0 +1,136 @@
+"""
+Cache parsed author names.
+"""
+
+import json
+import os
+from collections import OrderedDict
+from threading import Lock
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class NameCache(object):
+    """
+    Bounded LRU cache of parsed name components keyed on the raw name
+    string. Collaboration authors appear on thousands of records of a
+    harvest and HumanName parsing is expensive.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._names = OrderedDict()
+        self._lock = Lock()
+        # Names parsed since record() was called, or None.
+        self._recorded = None
+
+    def __len__(self):
+        return len(self._names)
+
+    def parse(self, name):
+        """
+        :param name: name as string - last, first, middle
+        :return: tuple of first, middle, last
+        """
+        with self._lock:
+            parts = self._names.pop(name, None)
+            if parts is not None:
+                self.hits += 1
+                # Re-insert as most recently used.
+                self._names[name] = parts
+                return parts
+            self.misses += 1
+        # Imported on first use, so harvesting without mapping does
+        # not load the parser.
+        from nameparser import HumanName
+        parsed = HumanName(name)
+        parts = (parsed.first, parsed.middle, parsed.last)
+        with self._lock:
+            self._names[name] = parts
+            if self._recorded is not None:
+                self._recorded.append((name, parts))
+            while len(self._names) > self.maxsize:
+                self._names.popitem(last=False)
+        return parts
+
+    def stats(self):
+        """
+        :return: dict of hits, misses, size and maxsize
+        """
+        return dict(hits=self.hits, misses=self.misses, size=len(self._names), maxsize=self.maxsize)
+
+    def record(self):
+        """
+        Start recording the names parsed, so a worker process can
+        return them to the cache of the parent.
+        """
+        with self._lock:
+            self._recorded = []
+
+    def recorded(self):
+        """
+        Stop recording.
+
+        :return: list of (str, tuple) names parsed since record()
+        """
+        with self._lock:
+            names, self._recorded = self._recorded or [], None
+        return names
+
+    def update(self, names, hits=0, misses=0):
+        """
+        Add names parsed elsewhere, e.g. in a worker process, and count
+        the lookups made there.
+
+        :param names: list of (str, tuple) names and their parts
+        :param hits: int
+        :param misses: int
+        """
+        with self._lock:
+            for name, parts in names:
+                self._names.pop(name, None)
+                self._names[name] = tuple(parts)
+            while len(self._names) > self.maxsize:
+                self._names.popitem(last=False)
+            self.hits += hits
+            self.misses += misses
+
+    def clear(self):
+        with self._lock:
+            self._names.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def load(self, path):
+        """
+        Add names saved by an earlier run. Does nothing if the file
+        does not exist.
+        """
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            names = json.load(f)
+        with self._lock:
+            for name, parts in names:
+                self._names[name] = tuple(parts)
+            while len(self._names) > self.maxsize:
+                self._names.popitem(last=False)
+        logger.debug("Loaded {} parsed names from {}.".format(len(names), path))
+
+    def save(self, path):
+        """
+        Save the cached names, least recently used first.
+        """
+        with self._lock:
+            names = [[name, list(parts)] for name, parts in self._names.items()]
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(names, f)
+        os.rename(tmp, path)
+
+
+# Cache used by record.Record.
+name_cache = NameCache()
@@ -0,0 +1,304 @@
+"""
+Map records to RDF in parallel, or in a stage of its own while
+records are fetched and written.
+"""
+
+import sys
+import time
+from collections import deque
+from multiprocessing import Pool, cpu_count
+from Queue import Queue, Empty, Full
+from threading import Event, Thread
+
+import logging
+logger = logging.getLogger(__name__)
+
+from metrics import metrics
+from names import name_cache
+
+
+def _map_chunk(records):
+    """
+    Map records to N-Triples. Runs in a worker process.
+
+    The names parsed in the worker are returned with the result, as
+    the worker's copy of the name cache is lost when the pool ends.
+
+    :param records: list of record.Record
+    :return: (str, int, int, float, tuple) N-Triples, number of triples
+        and of records, the seconds spent mapping and the names parsed,
+        name cache hits and misses
+    """
+    start = time.time()
+    hits, misses = name_cache.hits, name_cache.misses
+    name_cache.record()
+    lines = []
+    try:
+        for rec in records:
+            lines.extend(rec.to_nt().splitlines())
+    finally:
+        names = (name_cache.recorded(), name_cache.hits - hits, name_cache.misses - misses)
+    lines = [line for line in lines if line]
+    if not lines:
+        return "", 0, len(records), time.time() - start, names
+    return "\n".join(lines) + "\n", len(lines), len(records), time.time() - start, names
+
+
+def _mapped(result, dimensions=None):
+    """
+    Record the mapping time a worker reported in the metrics of this
+    process, add the names it parsed to the name cache of this process
+    and drop shared resources emitted before.
+    """
+    nt, triples, records, seconds, names = result
+    name_cache.update(*names)
+    metrics.observe('map_seconds', seconds, count=records)
+    metrics.incr('records_mapped', records)
+    if dimensions is not None:
+        nt, triples = dimensions.filter_ntriples(nt)
+    return nt, triples, records
+
+
+def _chunks(records, size):
+    chunk = []
+    for rec in records:
+        chunk.append(rec)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def map_records(records, processes=None, chunksize=100, dimensions=None):
+    """
+    Map records in a pool of worker processes.
+
+    Records are sent to the workers in chunks, pickled as their
+    fields, and the workers return N-Triples. While the workers map, the calling
+    process keeps reading records, so a harvest keeps fetching pages.
+    At most processes * 2 chunks are in flight. Chunks are returned in
+    record order.
+
+    :param records: iterable of record.Record
+    :param processes: int, defaults to the number of CPUs
+    :param chunksize: int records per chunk
+    :param dimensions: record.Dimensions to emit shared venues once
+    :return: generator of (str, int, int) N-Triples, number of triples and of records
+    """
+    processes = processes or cpu_count()
+    pool = Pool(processes)
+    window = processes * 2
+    pending = deque()
+    try:
+        for chunk in _chunks(records, chunksize):
+            pending.append(pool.apply_async(_map_chunk, (chunk,)))
+            while len(pending) >= window or (pending and pending[0].ready()):
+                yield _mapped(pending.popleft().get(), dimensions)
+        while pending:
+            yield _mapped(pending.popleft().get(), dimensions)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# Records held between two stages of a staged harvest, about two
+# result pages.
+QUEUE_SIZE = 200
+
+# End of the items passed between stages.
+_DONE = object()
+
+
+class _Failed(object):
+    """
+    An exception raised in a stage, passed on to the writing thread.
+    """
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+class Stage(object):
+    """
+    Time a pipeline stage spent working and waiting on the stages
+    next to it.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.busy = 0.0
+        self.waiting = 0.0
+        self.items = 0
+
+    def utilization(self):
+        total = self.busy + self.waiting
+        return self.busy / total if total else 0.0
+
+    def __str__(self):
+        return "{} {:.0%} busy ({:.1f}s for {} items)".format(self.name, self.utilization(), self.busy, self.items)
+
+
+def _put(queue, item, stage, stop):
+    start = time.time()
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            break
+        except Full:
+            continue
+    stage.waiting += time.time() - start
+
+
+def _get(queue, stage, stop):
+    start = time.time()
+    item = _DONE
+    while not stop.is_set():
+        try:
+            item = queue.get(timeout=0.1)
+            break
+        except Empty:
+            continue
+    stage.waiting += time.time() - start
+    return item
+
+
+def _fetch(records, out, stage, stop):
+    """
+    Read records from a harvest. Runs in its own thread.
+    """
+    records = iter(records)
+    try:
+        while not stop.is_set():
+            start = time.time()
+            try:
+                rec = next(records)
+            except StopIteration:
+                break
+            stage.busy += time.time() - start
+            stage.items += 1
+            _put(out, rec, stage, stop)
+    except Exception:
+        _put(out, _Failed(sys.exc_info()), stage, stop)
+        return
+    _put(out, _DONE, stage, stop)
+
+
+def _map(mapper, source, out, stage, stop):
+    """
+    Map the records of the fetch stage. Runs in its own thread.
+    """
+    while True:
+        item = _get(source, stage, stop)
+        if item is _DONE or isinstance(item, _Failed):
+            _put(out, item, stage, stop)
+            return
+        start = time.time()
+        try:
+            result = mapper(item)
+        except Exception:
+            _put(out, _Failed(sys.exc_info()), stage, stop)
+            return
+        stage.busy += time.time() - start
+        stage.items += 1
+        _put(out, result, stage, stop)
+
+
+def prefetched(sources, ahead=1, queue_size=QUEUE_SIZE):
+    """
+    Read several iterables at the same time and yield their items in
+    order, the first iterable's items first. Up to `ahead` iterables
+    are read at once, each in its own thread into a queue of
+    queue_size items, so at most ahead * queue_size items are held
+    ahead of the consumer. The next iterable is started once the
+    first one is used up.
+
+    An exception raised reading an iterable is raised again in the
+    consuming thread.
+
+    :param sources: iterable of iterables, e.g. harvest generators
+    :param ahead: int number of iterables read at once
+    :param queue_size: int
+    :return: generator of items
+    """
+    stop = Event()
+    sources = iter(sources)
+    running = deque()
+
+    def start_next():
+        for source in sources:
+            queue = Queue(queue_size)
+            thread = Thread(target=_fetch, args=(source, queue, Stage("fetch"), stop))
+            thread.daemon = True
+            thread.start()
+            running.append((queue, thread))
+            return True
+        return False
+
+    try:
+        while len(running) < ahead and start_next():
+            pass
+        consumer = Stage("consume")
+        while running:
+            queue, thread = running[0]
+            while True:
+                item = _get(queue, consumer, stop)
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failed):
+                    raise item.exc_info[0], item.exc_info[1], item.exc_info[2]
+                yield item
+            running.popleft()
+            thread.join()
+            start_next()
+    finally:
+        stop.set()
+        for queue, thread in running:
+            thread.join()
+
+
+def staged(records, mapper, writer, queue_size=QUEUE_SIZE):
+    """
+    Fetch, map and write records in three stages that run at the same
+    time. Records are read from the harvest in one thread and mapped
+    in another while the calling thread writes, so the next page is
+    downloaded while records of the current one are mapped and
+    written. The stages are connected by queues of queue_size items.
+    A stage that gets ahead blocks until the next one catches up.
+
+    An exception raised in any stage stops the pipeline and is raised
+    again in the calling thread.
+
+    :param records: iterable of record.Record
+    :param mapper: function called with each record in the map stage
+    :param writer: function called with each mapped record in order
+    :param queue_size: int
+    :return: list of Stage for fetch, map and write
+    """
+    stop = Event()
+    fetched = Queue(queue_size)
+    mapped = Queue(queue_size)
+    fetch, map_, write = Stage("fetch"), Stage("map"), Stage("write")
+    threads = [
+        Thread(target=_fetch, args=(records, fetched, fetch, stop)),
+        Thread(target=_map, args=(mapper, fetched, mapped, map_, stop)),
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        while True:
+            item = _get(mapped, write, stop)
+            if item is _DONE:
+                break
+            if isinstance(item, _Failed):
+                raise item.exc_info[0], item.exc_info[1], item.exc_info[2]
+            start = time.time()
+            writer(item)
+            write.busy += time.time() - start
+            write.items += 1
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return [fetch, map_, write]
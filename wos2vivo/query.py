@@ -2,8 +2,11 @@
 Build query documents for the WoS Lite API.
 """
 
+import re
 import xml.etree.ElementTree as ET
+from datetime import date
 from xml.dom import minidom
+from xml.sax.saxutils import escape
 
 ns = {
     "soapenv": "http://schemas.xmlsoap.org/soap/envelope/",
@@ -14,21 +17,51 @@ ET.register_namespace("soapenv", ns["soapenv"])
 ET.register_namespace("woksearchlite", ns["woksearchlite"])
 
 
-# Base SOAP message for querying.
-QUERY = """
-<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
-   xmlns:woksearchlite="http://woksearchlite.v3.wokmws.thomsonreuters.com">
+def _compile(template):
+    """
+    Collapse the indentation of a message template to one line, once,
+    so messages are built by substitution alone.
+    """
+    return re.sub(r"\s*\n\s*", "", template.strip())
+
+
+def _escape(value):
+    """
+    Escape a parameter for substitution into a message template.
+
+    :param value: str, unicode or int
+    :return: str ASCII, non-ASCII characters as character references
+    """
+    if isinstance(value, str):
+        value = value.decode('utf-8')
+    elif not isinstance(value, unicode):
+        value = unicode(value)
+    return escape(value).encode('ascii', 'xmlcharrefreplace')
+
+
+# SOAP message for querying, with placeholders for the parameters.
+QUERY = _compile("""
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:woksearchlite="http://woksearchlite.v3.wokmws.thomsonreuters.com">
    <soapenv:Header/>
    <soapenv:Body>
       <woksearchlite:search>
          <queryParameters>
+            <databaseId>WOS</databaseId>
+            <userQuery>{query}</userQuery>
+            {date}
+            <queryLanguage>en</queryLanguage>
          </queryParameters>
          <retrieveParameters>
+            <firstRecord>{start}</firstRecord>
+            <count>{count}</count>
          </retrieveParameters>
       </woksearchlite:search>
    </soapenv:Body>
 </soapenv:Envelope>
-"""
+""")
+
+SYMBOLIC_TIME_SPAN = "<symbolicTimeSpan>{}week</symbolicTimeSpan>"
+TIME_SPAN = "<timeSpan><begin>{begin}</begin><end>{end}</end></timeSpan>"
 
 
 class Query(object):
@@ -39,19 +72,18 @@ class Query(object):
     def __init__(self, query, weeks=None, span=None, start=1, count=100):
         if query is None:
             raise Exception("No query passed. Query required.")
-        self.root = ET.fromstring(QUERY)
-        search = self.root.find(".//queryParameters")
-        qp = self.query_params(query)
-        search.extend(qp)
-        date_params = self.date(weeks, span)
-        if date_params is not None:
-            # Append date
-            search.append(date_params)
-        # Query Language required.
-        search.append(self._elem("queryLanguage", "en"))
-        retrieve = self.root.find(".//retrieveParameters")
-        rp = self.retrieve_params(start, count)
-        retrieve.extend(rp)
+        self.query = query
+        self.weeks = weeks
+        self.span = span
+        self.count = count
+        # Symbolic time spans end on the day the query is run.
+        self.run_date = date.today() if weeks is not None else None
+        self.message = QUERY.format(
+            query=_escape(query),
+            date=self._date_params(weeks, span),
+            start=_escape(start),
+            count=_escape(count)
+        )
 
     @staticmethod
     def _elem(name, text=None):
@@ -61,67 +93,96 @@ class Query(object):
         return e
 
     def query_params(self, query):
+        """
+        :return: ET.Element queryParameters with the database and user query
+        """
         qp = self._elem("queryParameters")
-        db = self._elem("databaseId", text="WOS")
-        uq = self._elem("userQuery", text=query)
-        qp.append(db)
-        qp.append(uq)
+        qp.append(self._elem("databaseId", text="WOS"))
+        qp.append(self._elem("userQuery", text=query))
         return qp
 
     def retrieve_params(self, first, count):
+        """
+        :return: ET.Element retrieveParameters
+        """
         rp = self._elem("retrieveParameters")
-        first = self._elem("firstRecord", str(first))
-        rp.append(first)
-        count = self._elem("count", str(count))
-        rp.append(count)
+        rp.append(self._elem("firstRecord", str(first)))
+        rp.append(self._elem("count", str(count)))
         return rp
 
     def date(self, weeks, span):
+        """
+        :return: ET.Element symbolicTimeSpan or timeSpan, or None
+        """
+        params = self._date_params(weeks, span)
+        if params:
+            return ET.fromstring(params)
+
+    @staticmethod
+    def _date_params(weeks, span):
         if weeks is not None:
             if weeks not in [1, 2, 4]:
                 raise Exception("Valid week parameters are 1, 2, 4")
-            wk_str = "{}week".format(weeks)
-            symbolic_time = self._elem("symbolicTimeSpan", wk_str)
-            return symbolic_time
+            return SYMBOLIC_TIME_SPAN.format(weeks)
         elif span is not None:
             if (span.get('start')) or (span.get('end') is None):
                 Exception("Both start and end are required for time span queries.")
-            ts = ET.Element('timeSpan')
-            begin = ET.Element('begin')
-            begin.text = span['begin']
-            end = ET.Element('end')
-            end.text = span['end']
-            ts.append(begin)
-            ts.append(end)
-            return ts
+            return TIME_SPAN.format(begin=_escape(span['begin']), end=_escape(span['end']))
         else:
-            return
+            return ""
+
+    @property
+    def root(self):
+        """
+        The message as an element tree.
+        """
+        return ET.fromstring(self.message)
 
     def to_string(self):
-        return ET.tostring(self.root)
+        return self.message
+
+    def cache_key(self):
+        """
+        Normalized query parameters, without the first record. The
+        same search gives the same key in any session. Searches of
+        the last weeks include the date they were run on, as their
+        results change from day to day.
+        """
+        query = self.query
+        if isinstance(query, str):
+            query = query.decode('utf-8')
+        parts = [
+            "databaseId=WOS",
+            u"userQuery=" + u" ".join(query.split()),
+        ]
+        if self.weeks is not None:
+            parts.append("symbolicTimeSpan={}week@{}".format(self.weeks, self.run_date.isoformat()))
+        elif self.span is not None:
+            parts.append("timeSpan={}/{}".format(self.span['begin'], self.span['end']))
+        parts.append("queryLanguage=en")
+        parts.append("count={}".format(self.count))
+        return u"|".join(parts)
 
     def pretty(self):
-        xstring = ET.tostring(self.root)
-        xml = minidom.parseString(xstring)
+        xml = minidom.parseString(self.message)
         return xml.toprettyxml(indent=u" ")
 
-# SOAP message for retrieving prior query
-RETRIEVE = """
+
+# SOAP message for retrieving prior query, with placeholders for the
+# parameters.
+RETRIEVE = _compile("""
 <soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
 <soap:Body>
   <ns2:retrieve xmlns:ns2="http://woksearchlite.v3.wokmws.thomsonreuters.com">
-
-    <queryId>1</queryId>
-
+    <queryId>{query_id}</queryId>
     <retrieveParameters>
-       <firstRecord>101</firstRecord>
-       <count>100</count>
+       <firstRecord>{start}</firstRecord>
+       <count>{count}</count>
     </retrieveParameters>
-
   </ns2:retrieve>
 </soap:Body>
 </soap:Envelope>
-"""
+""")
 
 
 class Retrieve(object):
@@ -134,19 +195,21 @@ class Retrieve(object):
     def __init__(self, qid, start=1, count=100):
         if qid is None:
             raise Exception("No query id passed. Query id required.")
-        self.root = ET.fromstring(RETRIEVE)
-
-        query_id = self.root.find(".//queryId")
-        query_id.text = qid
-
-        first = self.root.find(".//firstRecord")
-        first.text = str(start)
-
-        num = self.root.find(".//count")
-        num.text = str(count)
+        self.message = RETRIEVE.format(
+            query_id=_escape(qid),
+            start=_escape(start),
+            count=_escape(count)
+        )
+
+    @property
+    def root(self):
+        """
+        The message as an element tree.
+        """
+        return ET.fromstring(self.message)
 
     def to_string(self):
-        return ET.tostring(self.root)
+        return self.message
 
 
 if __name__ == "__main__":
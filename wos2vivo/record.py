@@ -4,10 +4,11 @@ Read WoS records and map to VIVO.
 """
 
 import os
-from rdflib import Namespace, Graph, RDF, Literal, RDFS, XSD
-from rdflib.resource import Resource
-from time import strptime
-from nameparser import HumanName
+import re
+import xml.etree.ElementTree as ET
+from rdflib import Namespace, Graph, RDF, Literal, RDFS, URIRef, XSD
+
+from names import name_cache
 
 import logging
 logger = logging.getLogger(__name__)
@@ -20,32 +21,259 @@ OBO = Namespace('http://purl.obolibrary.org/obo/')
 VCARD = Namespace('http://www.w3.org/2006/vcard/ns#')
 WOS = Namespace('http://webofscience.com/ontology/wos#')
 
+# Month abbreviations as WoS writes them, e.g. MAR 15, to month numbers.
+MONTHS = dict(
+    (abbr, num + 1) for num, abbr in enumerate(
+        ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
+    )
+)
+
+# Characters rdflib warns about in URIs.
+INVALID_URI = re.compile(u'[<>" {}|\\\\^`]')
+
+# Literals kept by Terms before the cache starts over.
+LITERAL_CACHE = 100000
+
+
+class Terms(object):
+    """
+    Factory for the RDF terms of the mapping.
+
+    Namespace attribute lookups build a new URIRef, checked character
+    by character, on every call. The classes and properties the
+    mapping uses are built once here, literals that repeat across
+    records, e.g. ranks, venue labels and dates, are cached, and
+    record URIs are built from prefixes of the data namespace.
+    """
+
+    # Classes
+    bibo_AcademicArticle = BIBO.AcademicArticle
+    bibo_Book = BIBO.Book
+    bibo_Journal = BIBO.Journal
+    vcard_Individual = VCARD.Individual
+    vcard_Name = VCARD.Name
+    vcard_URL = VCARD.URL
+    vivo_Authorship = VIVO.Authorship
+    vivo_DateTimeValue = VIVO.DateTimeValue
+    # Properties
+    rdf_type = RDF.type
+    rdfs_label = RDFS.label
+    bibo_doi = BIBO.doi
+    bibo_end = BIBO.end
+    bibo_isbn = BIBO.isbn
+    bibo_issn = BIBO.issn
+    bibo_issue = BIBO.issue
+    bibo_start = BIBO.start
+    bibo_volume = BIBO.volume
+    obo_ARG_2000028 = OBO['ARG_2000028']
+    vcard_familyName = VCARD.familyName
+    vcard_givenName = VCARD.givenName
+    vcard_hasName = VCARD.hasName
+    vcard_hasURL = VCARD.hasURL
+    vcard_url = VCARD.url
+    vivo_dateTime = VIVO.dateTime
+    vivo_dateTimePrecision = VIVO.dateTimePrecision
+    vivo_dateTimeValue = VIVO.dateTimeValue
+    vivo_hasPublicationVenue = VIVO.hasPublicationVenue
+    vivo_middleName = VIVO.middleName
+    vivo_rank = VIVO.rank
+    vivo_relates = VIVO.relates
+    vivo_yearMonthPrecision = VIVO.yearMonthPrecision
+    vivo_yearPrecision = VIVO.yearPrecision
+    wos_wosId = WOS.wosId
+    # Literals
+    wos_label = Literal(u"Web of Science™")
+
+    def __init__(self, namespace):
+        """
+        :param namespace: rdflib.Namespace of the data
+        """
+        self.namespace = unicode(namespace)
+        self._prefixes = {}
+        self._ranks = [None]
+        self._literals = {}
+
+    def uri(self, kind, *parts):
+        """
+        URI in the data namespace, e.g. uri('vcard-name', '1', localid)
+        for d:vcard-name-1-<localid>.
+
+        :param kind: str type of resource
+        :param parts: str parts of the local name, joined with -
+        :return: rdflib.URIRef
+        """
+        prefix = self._prefixes.get(kind)
+        if prefix is None:
+            prefix = self._prefixes[kind] = self.namespace + kind + u"-"
+        value = prefix + u"-".join(parts)
+        if INVALID_URI.search(value):
+            # Let rdflib warn about it.
+            return URIRef(value)
+        # The same as URIRef(value), without checking each character
+        # again.
+        return unicode.__new__(URIRef, value)
+
+    def rank(self, position):
+        """
+        :param position: int number in author order, from 1
+        :return: rdflib.Literal
+        """
+        ranks = self._ranks
+        while len(ranks) <= position:
+            ranks.append(Literal(len(ranks)))
+        return ranks[position]
+
+    def literal(self, value, datatype=None):
+        """
+        Literal for a value that repeats across records.
+
+        :param value: str or unicode
+        :param datatype: rdflib.URIRef
+        :return: rdflib.Literal
+        """
+        key = (value, datatype)
+        literal = self._literals.get(key)
+        if literal is None:
+            if len(self._literals) >= LITERAL_CACHE:
+                self._literals.clear()
+            literal = self._literals[key] = Literal(value, datatype=datatype)
+        return literal
+
+
+# Terms of the data namespace.
+terms = Terms(D)
+
+
+class Dimensions(object):
+    """
+    Resources many records share, such as journals, that were already
+    emitted during a run. Records mapped with the same Dimensions only
+    emit the triples describing a shared resource the first time and
+    otherwise just link to it.
+    """
+
+    # Subjects of venue triples in N-Triples.
+    VENUE_PREFIX = "<{}venue-".format(D)
+
+    def __init__(self):
+        self.venues = set()
+
+    def first(self, uri):
+        """
+        Determine if a venue is emitted for the first time, and mark
+        it emitted.
+        :param uri: rdflib.URIRef
+        :return: boolean
+        """
+        uri = unicode(uri)
+        if uri in self.venues:
+            return False
+        self.venues.add(uri)
+        return True
+
+    def filter_ntriples(self, nt):
+        """
+        Drop the triples of venues emitted before from N-Triples
+        mapped elsewhere, e.g. in a worker process.
+
+        :param nt: str N-Triples
+        :return: (str, int) N-Triples and number of triples
+        """
+        lines = []
+        new = set()
+        for line in nt.splitlines():
+            if line.startswith(self.VENUE_PREFIX):
+                uri = line.split(' ', 1)[0][1:-1].decode('utf-8')
+                if uri in self.venues:
+                    continue
+                new.add(uri)
+            if line:
+                lines.append(line)
+        self.venues.update(new)
+        if not lines:
+            return "", 0
+        return "\n".join(lines) + "\n", len(lines)
+
 
 class Record(object):
     """
     Parse the XML returned by the WoS API.
     Convert to VIVO RDF with to_rdf.
+
+    The fields the mapping uses are read from the element once and
+    the element is not kept, so a record holds a few strings instead
+    of an element tree.
     """
 
+    __slots__ = ('_ut', '_title', '_authors', '_sources', '_others', '_localid', '_pub_uri')
+
     def __init__(self, element):
-        self.root = element
+        self._ut = None
+        self._title = None
+        authors = []
+        # Label to value indexes of the source and other fields.
+        self._sources = {}
+        self._others = {}
+        indexes = {'source': self._sources, 'other': self._others}
+        for item in element:
+            tag = item.tag
+            index = indexes.get(tag)
+            if index is not None:
+                # Keep the first value for a label, as WoS lists them.
+                index.setdefault(item.find('label').text, item.find('value').text)
+            elif tag == 'authors':
+                authors.extend(au.text for au in item.findall('value'))
+            elif tag == 'uid':
+                if self._ut is None:
+                    self._ut = item.text
+            elif tag == 'title':
+                value = item.find('value')
+                if self._title is None and value is not None:
+                    self._title = value.text
+        self._authors = tuple(authors)
+        self._localid = None
+        self._pub_uri = None
+
+    def __getstate__(self):
+        return self._ut, self._title, self._authors, self._sources, self._others
+
+    def __setstate__(self, state):
+        self._ut, self._title, self._authors, self._sources, self._others = state
+        self._localid = None
+        self._pub_uri = None
+
+    @property
+    def root(self):
+        """
+        The fields of the record as an element, rebuilt on access.
+        """
+        root = ET.Element('records')
+        ET.SubElement(root, 'uid').text = self._ut
+        title = ET.SubElement(root, 'title')
+        ET.SubElement(title, 'label').text = 'Title'
+        ET.SubElement(title, 'value').text = self._title
+        for tag, index in [('source', self._sources), ('other', self._others)]:
+            for label, value in sorted(index.items()):
+                item = ET.SubElement(root, tag)
+                ET.SubElement(item, 'label').text = label
+                ET.SubElement(item, 'value').text = value
+        authors = ET.SubElement(root, 'authors')
+        ET.SubElement(authors, 'label').text = 'Authors'
+        for au in self._authors:
+            ET.SubElement(authors, 'value').text = au
+        return root
 
     def ut(self):
-        return self.root.find('uid').text
+        return self._ut
 
     def title(self):
-        return self.root.find("title/value").text
+        return self._title
 
     def authors(self):
-        out = []
-        for au in self.root.findall('authors/value'):
-            out.append(au.text)
-        return out
+        return list(self._authors)
 
     def _identifier(self, tag):
-        for item in self.root.findall('other'):
-            if item.find('label').text == "Identifier.{}".format(tag):
-                return item.find('value').text
+        return self._others.get("Identifier." + tag)
 
     def doi(self):
         doi = self._identifier('Doi')
@@ -54,9 +282,7 @@ class Record(object):
         return doi
 
     def _source(self, label):
-        for item in self.root.findall('source'):
-            if item.find('label').text == label:
-                return item.find('value').text
+        return self._sources.get(label)
 
     def venue(self):
         return self._source("SourceTitle")
@@ -96,11 +322,15 @@ class Record(object):
         """
         Property used in building URIS.
         """
-        return self.ut().replace(':', '-')
+        if self._localid is None:
+            self._localid = self.ut().replace(':', '-')
+        return self._localid
 
     @property
     def pub_uri(self):
-        return D['pub-' + self.localid]
+        if self._pub_uri is None:
+            self._pub_uri = terms.uri('pub', self.localid)
+        return self._pub_uri
 
     @staticmethod
     def vivo_type():
@@ -108,7 +338,7 @@ class Record(object):
         For now return all WoS records as AcademicArticles.
         ToDo: add more specific types.
         """
-        return BIBO.AcademicArticle
+        return terms.bibo_AcademicArticle
 
     def in_book(self):
         """
@@ -125,195 +355,258 @@ class Record(object):
         Convert WoS date to year and month.
         """
         month, year = self.date()
-        try:
-            month_num = strptime(month.split()[0], "%b").tm_mon
-        except (ValueError, AttributeError):
-            month_num = None
+        month_num = MONTHS.get(month.upper()) if month is not None else None
         return year, month, month_num
 
-    def add_date(self):
+    @staticmethod
+    def _graph(triples):
         """
-        Add vivo:DateTimeValue for publication.
+        Collect triples in a new graph.
+        :param triples: iterable of (s, p, o)
         :return: rdflib.Graph
         """
         g = Graph()
-        date_uri = D['date-' + self.localid]
-        de = Resource(g, date_uri)
-        de.set(RDF.type, VIVO.DateTimeValue)
+        for triple in triples:
+            g.add(triple)
+        return g
+
+    def date_triples(self):
+        """
+        vivo:DateTimeValue for publication.
+        :return: generator of (s, p, o)
+        """
+        date_uri = terms.uri('date', self.localid)
+        yield date_uri, terms.rdf_type, terms.vivo_DateTimeValue
         year, month, month_num = self.pub_date()
         # Add year and month if possible.
         if month_num is not None:
-            de.set(RDFS.label, Literal("{}, {}".format(month, year)))
-            de.set(
-                VIVO.dateTime,
-                Literal("{}-{}-01T00:00:00".format(year, month_num), datatype=XSD.dateTime)
+            yield date_uri, terms.rdfs_label, terms.literal("{}, {}".format(month, year))
+            yield (
+                date_uri,
+                terms.vivo_dateTime,
+                terms.literal("{}-{}-01T00:00:00".format(year, month_num), datatype=XSD.dateTime)
             )
-            de.set(VIVO.dateTimePrecision, VIVO.yearMonthPrecision)
+            yield date_uri, terms.vivo_dateTimePrecision, terms.vivo_yearMonthPrecision
         else:
-            de.set(RDFS.label, Literal(year))
-            de.set(
-                VIVO.dateTime,
-                Literal("{}-01-01T00:00:00".format(year), datatype=XSD.dateTime)
+            yield date_uri, terms.rdfs_label, terms.literal(year)
+            yield (
+                date_uri,
+                terms.vivo_dateTime,
+                terms.literal("{}-01-01T00:00:00".format(year), datatype=XSD.dateTime)
             )
-            de.set(VIVO.dateTimePrecision, VIVO.yearPrecision)
+            yield date_uri, terms.vivo_dateTimePrecision, terms.vivo_yearPrecision
 
-        g.add((self.pub_uri, VIVO.dateTimeValue, date_uri))
-        return g
+        yield self.pub_uri, terms.vivo_dateTimeValue, date_uri
 
-    def add_venue(self):
+    def add_date(self):
         """
-        Add publication venue.
+        Add vivo:DateTimeValue for publication.
         :return: rdflib.Graph
         """
-        g = Graph()
+        return self._graph(self.date_triples())
+
+    def venue_triples(self, dimensions=None):
+        """
+        Publication venue. With dimensions, a venue emitted before is
+        only linked to.
 
+        :param dimensions: Dimensions
+        :return: generator of (s, p, o)
+        """
         isbn = self.isbn()
         issn = self.issn() or self.eissn()
 
         if isbn is not None:
-            vtype = BIBO.Book
-            uri = D['venue-' + isbn]
+            vtype = terms.bibo_Book
+            uri = terms.uri('venue', isbn)
         elif issn is not None:
-            vtype = BIBO.Journal
-            uri = D['venue-' + issn]
+            vtype = terms.bibo_Journal
+            uri = terms.uri('venue', issn)
         else:
             # Place holder
             logger.info("No source/venue ISSN or ISBN found for {}.".format(self.ut()))
-            vtype = BIBO.Journal
-            uri = D['venue-' + self.localid]
-
-        venue = Resource(g, uri)
-        venue.set(RDF.type, vtype)
-        venue.set(RDFS.label, Literal(self.venue()))
-        if vtype == BIBO.Journal:
-            venue.set(BIBO.issn, Literal(issn))
+            vtype = terms.bibo_Journal
+            uri = terms.uri('venue', self.localid)
+
+        if dimensions is not None and not dimensions.first(uri):
+            yield self.pub_uri, terms.vivo_hasPublicationVenue, uri
+            return
+
+        yield uri, terms.rdf_type, vtype
+        yield uri, terms.rdfs_label, terms.literal(self.venue())
+        if vtype is terms.bibo_Journal:
+            yield uri, terms.bibo_issn, terms.literal(issn)
         else:
-            venue.set(BIBO.isbn, Literal(isbn))
-        g.add((self.pub_uri, VIVO.hasPublicationVenue, uri))
+            yield uri, terms.bibo_isbn, terms.literal(isbn)
+        yield self.pub_uri, terms.vivo_hasPublicationVenue, uri
 
-        return g
+    def add_venue(self):
+        """
+        Add publication venue.
+        :return: rdflib.Graph
+        """
+        return self._graph(self.venue_triples())
 
-    def add_vcard(self, position, name):
+    def vcard_uri(self, position):
         """
         :param position: number in author order
-        :param name: name as string - last, first, middle
-        :return: rdflib.Graph
+        :return: rdflib.URIRef of the author's vcard individual
         """
-        g = Graph()
+        return terms.uri('vcard-individual', position, self.localid)
 
+    def vcard_triples(self, position, name):
+        """
+        :param position: number in author order
+        :param name: name as string - last, first, middle
+        :return: generator of (s, p, o)
+        """
         # vcard individual
-        vci_uri = D['vcard-individual-' + position + '-' + self.localid]
-        g.add((vci_uri, RDF.type, VCARD.Individual))
+        vci_uri = self.vcard_uri(position)
+        yield vci_uri, terms.rdf_type, terms.vcard_Individual
 
         # vcard name
-        vcn_uri = D['vcard-name-' + position + '-' + self.localid]
-        g.add((vcn_uri, RDF.type, VCARD.Name))
-        g.add((vcn_uri, RDFS.label, Literal(name)))
+        vcn_uri = terms.uri('vcard-name', position, self.localid)
+        yield vcn_uri, terms.rdf_type, terms.vcard_Name
+        yield vcn_uri, terms.rdfs_label, Literal(name)
         # Parse name into first, last, middle
-        name = HumanName(name)
-        g.add((vcn_uri, VCARD.givenName, Literal(name.first)))
-        g.add((vcn_uri, VCARD.familyName, Literal(name.last)))
-        if name.middle != "":
-            g.add((vcn_uri, VIVO.middleName, Literal(name.middle)))
+        first, middle, last = name_cache.parse(name)
+        yield vcn_uri, terms.vcard_givenName, terms.literal(first)
+        yield vcn_uri, terms.vcard_familyName, terms.literal(last)
+        if middle != "":
+            yield vcn_uri, terms.vivo_middleName, terms.literal(middle)
         # Relate vcard individual to vcard name
-        g.add((vci_uri, VCARD.hasName, vcn_uri))
-        return vci_uri, g
+        yield vci_uri, terms.vcard_hasName, vcn_uri
 
-    def authorship(self):
+    def add_vcard(self, position, name):
         """
-        Add authorship statements and vcards for authors.
+        :param position: number in author order
+        :param name: name as string - last, first, middle
         :return: rdflib.Graph
         """
-        g = Graph()
-        for num, au in enumerate(self.authors()):
-            position = str(num + 1)
+        return self.vcard_uri(position), self._graph(self.vcard_triples(position, name))
+
+    def authorship_triples(self):
+        """
+        Authorship statements and vcards for authors.
+        :return: generator of (s, p, o)
+        """
+        pub_uri = self.pub_uri
+        for num, au in enumerate(self._authors, 1):
+            position = str(num)
 
-            vcard_individual_uri, vcard_stmts = self.add_vcard(position, au)
-            g += vcard_stmts
+            for triple in self.vcard_triples(position, au):
+                yield triple
 
             # Authorship
-            aship_uri = D['authorship-' + position + '-' + self.localid]
-            g.add((aship_uri, RDF.type, VIVO.Authorship))
-            g.add((aship_uri, VIVO.rank, Literal(int(position))))
+            aship_uri = terms.uri('authorship', position, self.localid)
+            yield aship_uri, terms.rdf_type, terms.vivo_Authorship
+            yield aship_uri, terms.vivo_rank, terms.rank(num)
 
             # Relate pub and authorship
-            g.add((aship_uri, VIVO.relates, self.pub_uri))
+            yield aship_uri, terms.vivo_relates, pub_uri
 
             # Relate vcard and authorship
-            g.add((aship_uri, VIVO.relates, vcard_individual_uri))
+            yield aship_uri, terms.vivo_relates, self.vcard_uri(position)
 
-        return g
-
-    def add_vcard_weblink(self):
+    def authorship(self):
         """
-        Build statements for weblinks in VIVO.
+        Add authorship statements and vcards for authors.
         :return: rdflib.Graph
         """
+        return self._graph(self.authorship_triples())
+
+    def weblink_uri(self):
+        """
+        :return: rdflib.URIRef of the publication's vcard individual
+        """
+        return terms.uri('vcard-individual-pub', self.localid)
+
+    def weblink_triples(self):
+        """
+        Statements for weblinks in VIVO.
+        :return: generator of (s, p, o)
+        """
         base_url = "http://ws.isiknowledge.com/cps/openurl/service?url_ver=Z39.88-2004&rft_id=info:ut/WOS:{}"
-        g = Graph()
 
         # vcard individual for pub
-        vci_uri = D['vcard-individual-pub-' + self.localid]
-        g.add((vci_uri, RDF.type, VCARD.Individual))
+        vci_uri = self.weblink_uri()
+        yield vci_uri, terms.rdf_type, terms.vcard_Individual
 
         # vcard URL
-        vcu_uri = D['vcard-url-pub-' + self.localid]
-        g.add((vcu_uri, RDF.type, VCARD.URL))
-        g.add((vcu_uri, RDFS.label, Literal(u"Web of Science™")))
-        g.add((vcu_uri, VCARD.url, Literal(base_url.format(self.ut()))))
+        vcu_uri = terms.uri('vcard-url-pub', self.localid)
+        yield vcu_uri, terms.rdf_type, terms.vcard_URL
+        yield vcu_uri, terms.rdfs_label, terms.wos_label
+        yield vcu_uri, terms.vcard_url, Literal(base_url.format(self.ut()))
 
         # Relate vcard individual to url
-        g.add((vci_uri, VCARD.hasURL, vcu_uri))
-        return vci_uri, g
+        yield vci_uri, terms.vcard_hasURL, vcu_uri
+
+    def add_vcard_weblink(self):
+        """
+        Build statements for weblinks in VIVO.
+        :return: rdflib.Graph
+        """
+        return self.weblink_uri(), self._graph(self.weblink_triples())
 
-    def to_rdf(self):
+    def iter_triples(self, dimensions=None):
         """
-        Convert the API publication object to VIVO RDF.
+        Convert the API publication object to VIVO RDF statements
+        without building intermediate graphs.
 
-        :return: rdflib.Graph
+        :param dimensions: Dimensions shared by the records of a run
+        :return: generator of (s, p, o)
         """
-        g = Graph()
-        pub = Resource(g, self.pub_uri)
-        pub.set(RDF.type, self.vivo_type())
-        pub.set(RDFS.label, Literal(self.title()))
+        pub_uri = self.pub_uri
+        yield pub_uri, terms.rdf_type, self.vivo_type()
+        yield pub_uri, terms.rdfs_label, Literal(self.title())
         # WoS UT. Uncomment if you wish to map to generic VIVO.identifier
-        #pub.set(VIVO.identifier, Literal(self.ut()))
+        #yield pub_uri, VIVO.identifier, Literal(self.ut())
         # Map WoS UT to customer property. Used by other Web of Science Group Python tools
-        pub.set(WOS.wosId, Literal(self.ut().replace('WOS:','')))
+        yield pub_uri, terms.wos_wosId, Literal(self.ut().replace('WOS:',''))
         # DOI
         doi = self.doi()
         if doi is not None:
-            pub.set(BIBO.doi, Literal(doi))
+            yield pub_uri, terms.bibo_doi, Literal(doi)
         # Volume
         volume = self.volume()
         if volume is not None:
-            pub.set(BIBO.volume, Literal(volume))
+            yield pub_uri, terms.bibo_volume, terms.literal(volume)
         # Issue
         issue = self.issue()
         if issue is not None:
-            pub.set(BIBO.issue, Literal(issue))
+            yield pub_uri, terms.bibo_issue, terms.literal(issue)
         # Pages
         pages = self.pages()
         if pages is not None:
             start, end = pages.split('-')
-            pub.set(BIBO.start, Literal(start))
-            pub.set(BIBO.end, Literal(end))
+            yield pub_uri, terms.bibo_start, terms.literal(start)
+            yield pub_uri, terms.bibo_end, terms.literal(end)
 
         # publication venue
-        g += self.add_venue()
+        for triple in self.venue_triples(dimensions):
+            yield triple
         # date
-        g += self.add_date()
+        for triple in self.date_triples():
+            yield triple
 
         # authorship and vcards
-        g += self.authorship()
+        for triple in self.authorship_triples():
+            yield triple
 
         # links
-        web_link, linkg = self.add_vcard_weblink()
-        g += linkg
+        for triple in self.weblink_triples():
+            yield triple
         # relate web link and publication
-        g.add((self.pub_uri, OBO['ARG_2000028'], web_link))
+        yield pub_uri, terms.obo_ARG_2000028, self.weblink_uri()
 
-        return g
+    def to_rdf(self, dimensions=None):
+        """
+        Convert the API publication object to VIVO RDF.
+
+        :param dimensions: Dimensions shared by the records of a run
+        :return: rdflib.Graph
+        """
+        return self._graph(self.iter_triples(dimensions))
 
     def to_nt(self):
         g = self.to_rdf()
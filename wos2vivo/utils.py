@@ -1,20 +1,195 @@
+import os
+import sys
+import time
+from io import BytesIO
 
+from rdflib import Graph, RDF, RDFS, XSD
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constants import STREAM_FORMATS
+from encoder import Encoder, FORMATS as ENCODER_FORMATS
+from metrics import metrics
 from record import (
     D,
     BIBO,
     OBO,
     VCARD,
-    VIVO
+    VIVO,
+    WOS
 )
 
+# Prefixes bound on every serialized graph.
+PREFIXES = [
+    ("d", D),
+    ("vivo", VIVO),
+    ("vcard", VCARD),
+    ("obo", OBO),
+    ("bibo", BIBO),
+    ("wos", WOS),
+]
+
+# Encodes nt and turtle output.
+encoder = Encoder([("rdf", RDF), ("rdfs", RDFS), ("xsd", XSD)] + PREFIXES)
+
+
+def bind_namespaces(graph):
+    for prefix, namespace in PREFIXES:
+        graph.bind(prefix, namespace)
+    return graph
+
+
+def _encode(graph, stream, format):
+    for chunk in encoder.encode(graph, format=format):
+        stream.write(chunk)
+    if format == "nt":
+        # rdflib ends N-Triples with an empty line.
+        stream.write("\n")
+
+
+def encode_graph(graph, destination=None, format="nt"):
+    """
+    Serialize a graph with the encoder.
+
+    :param graph: rdflib.Graph
+    :param destination: path or file-like object, None to return the output
+    :param format: str one of encoder.FORMATS
+    :return: str when no destination is given
+    :raises: ValueError for terms the encoder can not write
+    """
+    if destination is None:
+        stream = BytesIO()
+        _encode(graph, stream, format)
+        return stream.getvalue()
+    if hasattr(destination, 'write'):
+        _encode(graph, destination, format)
+        return
+    with open(destination, 'wb') as stream:
+        _encode(graph, stream, format)
+
 
 def output_graph(graph, destination=None, format="turtle"):
     """
     Helper to output graph with namespaces bound.
+
+    N-Triples and Turtle are written with the encoder, other formats
+    and graphs the encoder can not write with rdflib.
     """
-    graph.bind("d", D)
-    graph.bind("vivo", VIVO)
-    graph.bind("vcard", VCARD)
-    graph.bind("obo", OBO)
-    graph.bind("bibo", BIBO)
-    return graph.serialize(destination=destination, format=format)
\ No newline at end of file
+    bind_namespaces(graph)
+    with metrics.timer('serialize_seconds'):
+        out = _serialize(graph, destination, format)
+    metrics.incr('triples', len(graph))
+    return out
+
+
+def _serialize(graph, destination, format):
+    if format in ENCODER_FORMATS:
+        try:
+            return encode_graph(graph, destination=destination, format=format)
+        except ValueError as e:
+            logger.warning("{} Serializing with rdflib.".format(e))
+    return graph.serialize(destination=destination, format=format)
+
+
+class StreamWriter(object):
+    """
+    Write triples to a file or stdout as they are produced rather than
+    collecting a whole harvest in one Graph.
+
+    N-Triples are written as is. Turtle gets a fixed prefix header and
+    each graph is written as its own block of statements. Pass
+    append=True to continue a file from an interrupted harvest.
+    """
+
+    def __init__(self, destination=None, format="nt", append=False):
+        if format not in STREAM_FORMATS:
+            raise Exception("Streaming output supports {} formats.".format(", ".join(STREAM_FORMATS)))
+        self.format = format
+        self.destination = destination
+        self.triples = 0
+        if destination is None:
+            self.stream = sys.stdout
+        else:
+            self.stream = open(destination, 'ab' if append else 'wb')
+        # Prefix declarations are written once, up front.
+        self.header = set()
+        if format == "turtle":
+            for prefix, namespace in [("rdf", RDF), ("rdfs", RDFS), ("xsd", XSD)] + PREFIXES:
+                line = "@prefix {}: <{}> .".format(prefix, namespace)
+                self.header.add(line)
+                self.stream.write(line + "\n")
+            self.stream.write("\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def write(self, graph):
+        """
+        Serialize and write one graph.
+
+        :param graph: rdflib.Graph
+        :return: int number of triples written
+        """
+        if len(graph) == 0:
+            return 0
+        start = time.time()
+        try:
+            if self.format == "turtle":
+                out = "".join(encoder.turtle(graph, header=False))
+            else:
+                out = "".join(encoder.ntriples(graph))
+        except ValueError as e:
+            logger.warning("{} Serializing with rdflib.".format(e))
+            out = self._serialize(graph)
+        self.stream.write(out)
+        metrics.observe('serialize_seconds', time.time() - start)
+        self.triples += len(graph)
+        metrics.incr('triples', len(graph))
+        return len(graph)
+
+    def _serialize(self, graph):
+        if self.format == "turtle":
+            bind_namespaces(graph)
+            out = graph.serialize(format="turtle")
+            # Drop the prefixes already in the header. Any other prefix
+            # rdflib generated stays, Turtle allows redeclaring them.
+            lines = [l for l in out.splitlines() if l.strip() not in self.header]
+            return "\n".join(lines).strip() + "\n\n"
+        return graph.serialize(format="nt")
+
+    def write_ntriples(self, data, count):
+        """
+        Write triples already serialized as N-Triples.
+
+        :param data: str N-Triples
+        :param count: int number of triples
+        :return: int number of triples written
+        """
+        if count == 0:
+            return 0
+        if self.format != "nt":
+            g = Graph()
+            g.parse(data=data, format="nt")
+            return self.write(g)
+        with metrics.timer('serialize_seconds'):
+            self.stream.write(data)
+        self.triples += count
+        metrics.incr('triples', count)
+        return count
+
+    def flush(self):
+        """
+        Write buffered triples through to the file.
+        """
+        self.stream.flush()
+        if self.destination is not None:
+            os.fsync(self.stream.fileno())
+
+    def close(self):
+        self.stream.flush()
+        if self.destination is not None:
+            self.stream.close()